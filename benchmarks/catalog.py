@@ -0,0 +1,92 @@
+"""Synthetic catalog generation for the benchmarks, following the layout of llista_productes.csv."""
+import csv
+import random
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+SOURCE_CSV = Path(__file__).resolve().parent.parent / "llista_productes.csv"
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+PRODUCTS_PER_CATEGORY = 2_500
+SUBCATEGORIES_PER_CATEGORY = 10
+# A re-upload changes the price of every UPDATED_EVERY-th seeded product and adds NEW_PRODUCTS_PER_100 new products
+# per 100 seeded ones, with ids far above those of the seeded and the benchmark-created products.
+UPDATED_EVERY = 10
+NEW_PRODUCTS_PER_100 = 5
+NEW_PRODUCT_ID_BASE = 100_000_000
+
+
+def load_template():
+    """Return the header and the rows of llista_productes.csv."""
+    with open(SOURCE_CSV, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        return header, list(reader)
+
+
+def parse_size(size: str) -> int:
+    """Accept a preset (10k, 100k, 1m) or a plain number of products."""
+    return SIZES[size.lower()] if size.lower() in SIZES else int(size)
+
+
+def count_subcategories(products: int) -> int:
+    """Return the number of subcategories generated for a catalog of `products` products."""
+    _, template = load_template()
+    categories = max(len({row[1] for row in template}), products // PRODUCTS_PER_CATEGORY)
+    return categories * SUBCATEGORIES_PER_CATEGORY
+
+
+def generate_rows(products: int, seed: int = 42) -> Iterator[List]:
+    """Yield `products` CSV rows with the columns of llista_productes.csv.
+
+    Names, descriptions and companies are taken from the sample file; ids, prices and units are generated. The
+    output only depends on `products` and `seed`.
+    """
+    _, template = load_template()
+    category_names = sorted({row[1] for row in template})
+    subcategory_names = sorted({row[3] for row in template})
+    categories = max(len(category_names), products // PRODUCTS_PER_CATEGORY)
+    rng = random.Random(seed)
+
+    for product_id in range(1, products + 1):
+        sample = template[rng.randrange(len(template))]
+        category_id = rng.randrange(categories) + 1
+        subcategory_id = (category_id - 1) * SUBCATEGORIES_PER_CATEGORY + rng.randrange(SUBCATEGORIES_PER_CATEGORY) + 1
+        yield [
+            category_id,
+            f"{category_names[(category_id - 1) % len(category_names)]} {category_id}",
+            subcategory_id,
+            f"{subcategory_names[(subcategory_id - 1) % len(subcategory_names)]} {subcategory_id}",
+            product_id,
+            f"{sample[5]} {product_id}",
+            sample[6],
+            sample[7],
+            round(rng.uniform(5, 3000), 2),
+            rng.randrange(500),
+        ]
+
+
+def generate_upload_rows(products: int, seed: int = 42) -> Iterator[List]:
+    """Yield the rows of a nightly re-upload of the catalog seeded with `products` and `seed`.
+
+    Every UPDATED_EVERY-th product has a new price and the rest are unchanged; the new products follow, in existing
+    categories and subcategories. Importing it inserts, updates and leaves unchanged a fixed share of the rows.
+    """
+    for row in generate_rows(products, seed):
+        if row[4] % UPDATED_EVERY == 0:
+            row[8] = round(row[8] + 1, 2)
+        yield row
+    for row in generate_rows(products * NEW_PRODUCTS_PER_100 // 100, seed + 1):
+        row[4] += NEW_PRODUCT_ID_BASE
+        row[5] = f"{row[5]} new"
+        yield row
+
+
+def write_csv(path: Path, rows: Iterable[List]) -> Path:
+    """Write catalog rows to a CSV file and return its path."""
+    header, _ = load_template()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
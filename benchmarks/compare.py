@@ -0,0 +1,46 @@
+"""Compare two result files written by benchmarks/run.py.
+
+Usage:
+    python benchmarks/compare.py benchmarks/results/before.json benchmarks/results/after.json
+"""
+import argparse
+import json
+from pathlib import Path
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{100 * (after - before) / before:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    args = parser.parse_args()
+
+    before = json.loads(args.before.read_text())
+    after = json.loads(args.after.read_text())
+    print(f"before: {before['commit']} ({before['products']} products)")
+    print(f"after:  {after['commit']} ({after['products']} products)")
+    print(f"{'route':45} " + " ".join(f"{metric:>30}" for metric in METRICS))
+
+    for route, result in after["routes"].items():
+        previous = before["routes"].get(route)
+        if not previous or not previous.get("requests") or not result.get("requests"):
+            continue
+        cells = [f"{previous[metric]} -> {result[metric]} ({change(previous[metric], result[metric])})"
+                 for metric in METRICS]
+        print(f"{route:45} " + " ".join(f"{cell:>30}" for cell in cells))
+
+    if "import" in before and "import" in after:
+        print(f"{'POST /products/loadProducts/ (rows/s)':45} "
+              f"{before['import']['rows_per_second']} -> {after['import']['rows_per_second']} "
+              f"{change(before['import']['rows_per_second'], after['import']['rows_per_second'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""Measure throughput and latency percentiles of every API route against a running server.
+
+Usage:
+    python benchmarks/seed.py --size 10k --yes
+    uvicorn main:app --workers 4
+    python benchmarks/run.py --size 10k --output benchmarks/results/10k.json
+
+The database must have been seeded with the same --size and --seed, since requests use the generated ids. Write
+routes only touch rows they create themselves, except the product updates, which rewrite seeded products with new
+values. Results are written as JSON so they can be compared between commits with benchmarks/compare.py.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import math
+import random
+import subprocess
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import httpx
+
+from catalog import SUBCATEGORIES_PER_CATEGORY, count_subcategories, generate_upload_rows, parse_size, write_csv
+
+HEAVY_ROUTE_REQUESTS = 10
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    build: Callable[[int], dict]
+    requests: Optional[int] = None
+    on_response: Optional[Callable[[httpx.Response], None]] = None
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(scenario: Scenario) -> dict:
+    """Return the throughput and latency figures of a scenario, in requests per second and milliseconds."""
+    latencies = scenario.latencies
+    if not latencies:
+        return {"requests": 0, "errors": scenario.errors, "skipped": scenario.skipped}
+    return {
+        "requests": len(latencies),
+        "errors": scenario.errors,
+        "skipped": scenario.skipped,
+        "throughput_rps": round(len(latencies) / scenario.elapsed, 2),
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 3),
+        "p50_ms": round(1000 * percentile(latencies, 0.50), 3),
+        "p95_ms": round(1000 * percentile(latencies, 0.95), 3),
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 3),
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int):
+    """Send the requests of a scenario with bounded concurrency and record their latencies."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(index: int):
+        async with semaphore:
+            try:
+                request = scenario.build(index)
+            except (IndexError, ZeroDivisionError):
+                # An earlier scenario did not create enough rows for this one.
+                scenario.skipped += 1
+                return
+            started = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, **request)
+            except httpx.HTTPError:
+                scenario.errors += 1
+                return
+            elapsed = time.perf_counter() - started
+            if response.status_code >= 400:
+                scenario.errors += 1
+                return
+            scenario.latencies.append(elapsed)
+            if scenario.on_response:
+                scenario.on_response(response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(index) for index in range(scenario.requests or requests)))
+    scenario.elapsed = time.perf_counter() - started
+
+
+def product_body(index: int, subcategory_id: int) -> dict:
+    return {"name": f"bench-product-{index}", "description": "Benchmark product", "company": "Benchmark",
+            "price": 100 + index % 50, "units": index % 20, "subcategory_id": subcategory_id}
+
+
+def build_scenarios(products: int, rng: random.Random, run_id: str) -> List[Scenario]:
+    """Describe one scenario per route; write scenarios are ordered so that they reuse the rows created before."""
+    subcategories = count_subcategories(products)
+    created_products: List[int] = []
+    created_subcategories: List[int] = []
+    category_base = 10_000_000 + rng.randrange(1_000_000) * 100
+
+    def random_product() -> int:
+        return rng.randrange(products) + 1
+
+    def collect_products(response: httpx.Response):
+        created_products.extend(item["product_id"] for item in response.json() if item["status"] == "created")
+
+    def collect_subcategories(response: httpx.Response):
+        created_subcategories.extend(row[0] for row in response.json() if str(row[1]).startswith(run_id))
+
+    def batch_ids(index: int, size: int = 10) -> list:
+        return created_products[index * size:(index + 1) * size]
+
+    stats_etags: List[str] = []
+    query_pages: List[dict] = []
+
+    def query_filters() -> dict:
+        category_id = rng.randrange(subcategories // SUBCATEGORIES_PER_CATEGORY) + 1
+        price_min = rng.randrange(5, 2500)
+        return rng.choice([
+            {"category_id": category_id, "sort": "price"},
+            {"category_id": category_id, "in_stock": "true", "sort": "name"},
+            {"price_min": price_min, "price_max": price_min + 500, "sort": "price", "direction": "desc"},
+            {"in_stock": "true", "sort": "updated_at", "direction": "desc"},
+        ])
+
+    def collect_query_page(response: httpx.Response):
+        # The follow-up page repeats the filters and sort of the first one, taken from its URL.
+        if response.json()["next_cursor"]:
+            query_pages.append(dict(response.request.url.params, cursor=response.json()["next_cursor"]))
+
+    def collect_stats_etag(response: httpx.Response):
+        if not stats_etags:
+            stats_etags.append(response.headers["ETag"])
+
+    return [
+        # routers/products.py
+        Scenario("GET /products/products/", "GET", lambda i: {"url": "/products/products/"},
+                 requests=HEAVY_ROUTE_REQUESTS),
+        Scenario("GET /products/products/?stream=ndjson", "GET",
+                 lambda i: {"url": "/products/products/", "params": {"stream": "ndjson"}},
+                 requests=HEAVY_ROUTE_REQUESTS),
+        Scenario("GET /products/product/{id}", "GET", lambda i: {"url": f"/products/product/{random_product()}"}),
+        Scenario("GET /products/products/ids/", "GET",
+                 lambda i: {"url": "/products/products/ids/", "params": {"ids": [random_product() for _ in range(20)]}}),
+        Scenario("GET /products/products/orderby/", "GET",
+                 lambda i: {"url": "/products/products/orderby/", "params": {"orderby": rng.choice(["asc", "desc"])}},
+                 requests=HEAVY_ROUTE_REQUESTS),
+        Scenario("GET /products/products/contain/", "GET",
+                 lambda i: {"url": "/products/products/contain/", "params": {"name": f"Pro {random_product()}"}}),
+        Scenario("GET /products/products/search/", "GET",
+                 lambda i: {"url": "/products/products/search/",
+                            "params": {"q": rng.choice(["laptop", "samsung", "auriculares", "pro", "camara"])}}),
+        Scenario("GET /products/products/skip_limit/", "GET",
+                 lambda i: {"url": "/products/products/skip_limit/",
+                            "params": {"skip": rng.randrange(max(1, products - 50)), "limit": 50}}),
+        Scenario("GET /products/products/cursor/", "GET",
+                 lambda i: {"url": "/products/products/cursor/",
+                            "params": {"limit": 50, "order": rng.choice(["id", "name"])}}),
+        Scenario("GET /products/stats/", "GET",
+                 lambda i: {"url": "/products/stats/", "params": {"group_by": "subcategory"}},
+                 on_response=collect_stats_etag),
+        # Revalidates the response above: the stats have not changed, so this measures the 304 path.
+        Scenario("GET /products/stats/ (If-None-Match)", "GET",
+                 lambda i: {"url": "/products/stats/", "params": {"group_by": "subcategory"},
+                            "headers": {"If-None-Match": stats_etags[0]}}),
+        Scenario("GET /products/products/query/", "GET",
+                 lambda i: {"url": "/products/products/query/", "params": dict(query_filters(), limit=50)},
+                 on_response=collect_query_page),
+        Scenario("GET /products/products/query/?cursor=", "GET",
+                 lambda i: {"url": "/products/products/query/", "params": query_pages[i % len(query_pages)]}),
+        # client.request reads the whole streamed body, so the latency covers the full download.
+        Scenario("GET /products/export/?format=csv", "GET",
+                 lambda i: {"url": "/products/export/", "params": {"format": "csv"}}, requests=HEAVY_ROUTE_REQUESTS),
+        Scenario("GET /products/export/?format=csv&gzip=true", "GET",
+                 lambda i: {"url": "/products/export/", "params": {"format": "csv", "gzip": "true"}},
+                 requests=HEAVY_ROUTE_REQUESTS),
+        Scenario("GET /products/export/?format=parquet", "GET",
+                 lambda i: {"url": "/products/export/", "params": {"format": "parquet"}},
+                 requests=HEAVY_ROUTE_REQUESTS),
+        Scenario("POST /products/product/", "POST",
+                 lambda i: {"url": "/products/product/", "json": product_body(i, rng.randrange(subcategories) + 1)}),
+        Scenario("POST /products/products/batch/", "POST",
+                 lambda i: {"url": "/products/products/batch/",
+                            "json": [product_body(i * 20 + j, rng.randrange(subcategories) + 1) for j in range(20)]},
+                 on_response=collect_products),
+        Scenario("PUT /products/product/{id}", "PUT",
+                 lambda i: {"url": f"/products/product/{random_product()}",
+                            "json": product_body(i, rng.randrange(subcategories) + 1)}),
+        Scenario("PUT /products/products/batch/", "PUT",
+                 lambda i: {"url": "/products/products/batch/",
+                            "json": [dict(product_body(i, rng.randrange(subcategories) + 1), product_id=product_id)
+                                     for product_id in batch_ids(i)]}),
+        Scenario("DELETE /products/product/{id}", "DELETE",
+                 lambda i: {"url": f"/products/product/{created_products.pop()}"}),
+        Scenario("DELETE /products/products/batch/", "DELETE",
+                 lambda i: {"url": "/products/products/batch/", "json": batch_ids(i) or [0]}),
+        # routers/categories.py
+        Scenario("GET /categories/categories/", "GET", lambda i: {"url": "/categories/categories/"}),
+        Scenario("GET /categories/category/{id}", "GET",
+                 lambda i: {"url": f"/categories/category/{rng.randrange(subcategories // SUBCATEGORIES_PER_CATEGORY) + 1}"}),
+        Scenario("POST /categories/category/", "POST",
+                 lambda i: {"url": "/categories/category/",
+                            "json": {"category_id": category_base + i, "name": f"{run_id}-{i}"}}),
+        Scenario("PUT /categories/category/{id}", "PUT",
+                 lambda i: {"url": f"/categories/category/{category_base + i}",
+                            "json": {"category_id": category_base + i, "name": f"{run_id}-{i}-updated"}}),
+        Scenario("DELETE /categories/category/{id}", "DELETE",
+                 lambda i: {"url": f"/categories/category/{category_base + i}"}),
+        # routers/subcategories.py
+        Scenario("POST /subcategories/subcategory/", "POST",
+                 lambda i: {"url": "/subcategories/subcategory/",
+                            "json": {"subcategory_id": 0, "name": f"{run_id}-{i}", "category_id": 1}}),
+        Scenario("GET /subcategories/subcategories/", "GET", lambda i: {"url": "/subcategories/subcategories/"},
+                 on_response=lambda response: collect_subcategories(response) if not created_subcategories else None),
+        Scenario("GET /subcategories/subcategory/{id}", "GET",
+                 lambda i: {"url": f"/subcategories/subcategory/{rng.randrange(subcategories) + 1}"}),
+        Scenario("PUT /subcategories/subcategory/{id}", "PUT",
+                 lambda i: {"url": f"/subcategories/subcategory/{created_subcategories[i % len(created_subcategories)]}",
+                            "json": {"subcategory_id": 0, "name": f"{run_id}-{i}-updated", "category_id": 1}}),
+        Scenario("DELETE /subcategories/subcategory/{id}", "DELETE",
+                 lambda i: {"url": f"/subcategories/subcategory/{created_subcategories.pop()}"}),
+    ]
+
+
+async def benchmark_import(client: httpx.AsyncClient, csv_path: Path) -> dict:
+    """Upload a catalog CSV to /products/loadProducts/ and time it, with the product counts it reports."""
+    with open(csv_path, newline="", encoding="utf-8") as file:
+        rows = sum(1 for _ in csv.reader(file)) - 1
+    started = time.perf_counter()
+    with open(csv_path, "rb") as file:
+        response = await client.post("/products/loadProducts/", files={"file": (csv_path.name, file, "text/csv")},
+                                     timeout=None)
+    elapsed = time.perf_counter() - started
+    result = {"status": response.status_code, "rows": rows, "seconds": round(elapsed, 3),
+              "rows_per_second": round(rows / elapsed, 1)}
+    if response.status_code < 400:
+        result["products"] = response.json()["result"]["products"]
+    return result
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--size", default="10k", help="size the database was seeded with (10k, 100k, 1m or a number)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed the database was seeded with")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--routes", help="only run the routes containing this text")
+    parser.add_argument("--skip-import", action="store_true", help="do not benchmark /products/loadProducts/")
+    parser.add_argument("--output", type=Path, help="JSON file for the results (default: benchmarks/results/...)")
+    args = parser.parse_args()
+
+    products = parse_size(args.size)
+    rng = random.Random(args.seed)
+    run_id = f"bench-{int(time.time())}"
+    scenarios = [scenario for scenario in build_scenarios(products, rng, run_id)
+                 if not args.routes or args.routes in scenario.name]
+    results = {
+        "commit": current_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "base_url": args.base_url,
+        "products": products,
+        "requests_per_route": args.requests,
+        "concurrency": args.concurrency,
+        "routes": {},
+    }
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=120) as client:
+        for scenario in scenarios:
+            await run_scenario(client, scenario, args.requests, args.concurrency)
+            results["routes"][scenario.name] = summarize(scenario)
+            print(f"{scenario.name:45} {json.dumps(results['routes'][scenario.name])}")
+
+        if not args.skip_import:
+            # The nightly re-upload case: most rows are unchanged, some have a new price and a few are new products.
+            # The product updates above also changed some seeded rows, which the import then updates back.
+            csv_path = write_csv(Path(__file__).parent / "data" / f"upload-{products}-{args.seed}.csv",
+                                 generate_upload_rows(products, args.seed))
+            results["import"] = await benchmark_import(client, csv_path)
+            print(f"{'POST /products/loadProducts/':45} {json.dumps(results['import'])}")
+
+    output = args.output or Path(__file__).parent / "results" / f"{results['commit'] or run_id}-{products}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,27 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
-from routers import products, categories, subcategories
+from database import open_pool, close_pool
+from routers import products, categories, subcategories, admin, metrics
+from services import change_listener, csv_import_job_service, product_listing_service
+from utils.loader import RequestLoadersMiddleware
+from utils.metrics import METRICS_ENABLED, RequestMetricsMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the database connection pool and start the background tasks on startup; undo it all on shutdown."""
+    await open_pool()
+    change_listener.start()
+    product_listing_service.start()
+    await csv_import_job_service.submit_queued_jobs()
+    yield
+    await product_listing_service.stop()
+    await change_listener.stop()
+    csv_import_job_service.shutdown()
+    await close_pool()
+
 
 app = FastAPI(
     title="Product Management API with FastAPI and PostgreSQL",
@@ -10,12 +31,20 @@ app = FastAPI(
     The API provides endpoints for creating, retrieving, updating, and deleting products, categories, and subcategories.
     """,
     version="1.0.0",
-    openapi_url="/api/v1/openapi.json"
+    openapi_url="/api/v1/openapi.json",
+    lifespan=lifespan
 )
 
+app.add_middleware(RequestLoadersMiddleware)
+if METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware)
+
 app.include_router(products.router, prefix="/products", tags=["Products"],
                    responses={404: {"description": "Not found"}})
 app.include_router(categories.router, prefix="/categories", tags=["Categories"],
                    responses={404: {"description": "Not found"}})
 app.include_router(subcategories.router, prefix="/subcategories", tags=["Subcategories"],
                    responses={404: {"description": "Not found"}})
+app.include_router(admin.router, prefix="/admin", tags=["Admin"])
+if METRICS_ENABLED:
+    app.include_router(metrics.router, tags=["Metrics"])
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -28,6 +28,10 @@ class ProductUpdate(ProductBase):
     pass
 
 
+class ProductBatchUpdate(ProductUpdate):
+    product_id: int
+
+
 class ProductInDB(ProductBase, BaseModelTimestamp):
     product_id: int
 
@@ -49,3 +53,62 @@ class ProductSubcategoryCategory(BaseModel):
     product_name: str
     product_brand: str
     price: float
+
+
+class ProductPage(BaseModel):
+    items: List[ProductSubcategoryCategory]
+    next_cursor: Optional[str] = None
+
+
+class ProductQueryPage(BaseModel):
+    items: List[ProductInDB]
+    next_cursor: Optional[str] = None
+
+
+class ProductSearchResult(ProductSubcategoryCategory):
+    product_id: int
+    rank: float
+
+
+class CatalogStats(BaseModel):
+    product_count: int
+    total_units: int
+    min_price: float
+    avg_price: float
+    max_price: float
+    stock_value: float
+
+
+class CategoryStats(CatalogStats):
+    category_id: int
+    category_name: str
+
+
+class SubcategoryStats(CategoryStats):
+    subcategory_id: int
+    subcategory_name: str
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    product_id: Optional[int] = None
+    status: str
+    message: Optional[str] = None
+
+
+class ImportJob(BaseModel):
+    job_id: str
+    status: str
+    workers: int
+    delete_missing: bool
+    last_committed_line: int
+    rows_processed: int
+    rows_rejected: int
+    rows_per_second: float
+    result: dict
+    errors: List[dict]
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    updated_at: str
+    finished_at: Optional[str] = None
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Query
+
+from services import product_listing_service
+from utils.cache import caches
+from utils import slow_queries
+from utils.singleflight import groups
+
+router = APIRouter()
+
+"""GET routes"""
+
+
+@router.get("/cache/", summary="Get cache statistics")
+async def get_cache_stats():
+    """Return the size and hit/miss counters of every in-process cache."""
+    return [cache.stats() for cache in caches]
+
+
+@router.get("/singleflight/", summary="Get query coalescing statistics")
+async def get_singleflight_stats():
+    """Return how many read queries were executed and how many were coalesced into one already in flight."""
+    return [group.stats() for group in groups]
+
+
+@router.get("/read-model/", summary="Get the state of the product listing read model")
+async def get_read_model():
+    """Return when the product listing read model was last refreshed and whether a refresh is pending here."""
+    return {"refreshed_at": await product_listing_service.fetch_refreshed_at(),
+            "refresh_pending": product_listing_service.changed_at is not None,
+            "refresh_interval_seconds": product_listing_service.READ_MODEL_REFRESH_SECONDS}
+
+
+@router.get("/slow-queries/", summary="Get the most recent slow queries")
+async def get_slow_queries(limit: int = Query(50, ge=1, le=1000)):
+    """Return the statements that exceeded the slow-query threshold, newest first, with their plan once captured."""
+    return slow_queries.recent(limit)
+
+
+"""POST routes"""
+
+
+@router.post("/read-model/refresh/", summary="Refresh the product listing read model")
+async def refresh_read_model():
+    """Refresh the product listing read model now instead of waiting for the background refresh."""
+    return await product_listing_service.refresh_now()
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from models import Category
 from services import category_service
+from utils.etag import make_etag, not_modified
 
 router = APIRouter()
 
@@ -8,20 +9,29 @@ router = APIRouter()
 
 
 @router.get("/categories/")
-async def get_all_categories():
+async def get_all_categories(request: Request, response: Response):
     """Fetch all categories from the database."""
-    categories = category_service.fetch_categories()
+    categories = await category_service.fetch_categories()
     if not categories:
         raise HTTPException(status_code=404, detail="No categories found")
+    # Derived from the rows served, so the ETag costs no query on a cache hit and always matches the body.
+    etag = make_etag("categories", categories)
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
     return categories
 
 
 @router.get("/category/{category_id}", summary="Get a category by ID")
-async def get_category_by_id(category_id: int):
+async def get_category_by_id(category_id: int, request: Request, response: Response):
     """Fetch a category by its ID from the database."""
-    category = category_service.fetch_category(category_id)
+    category = await category_service.fetch_category(category_id)
     if not category:
         raise HTTPException(status_code=404, detail=f"Category {category_id} not found")
+    etag = make_etag("category", category_id, category)
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
     return category
 
 
@@ -31,7 +41,7 @@ async def get_category_by_id(category_id: int):
 @router.post("/category/", summary="Create a new category")
 async def post_category(category: Category):
     """Create a new category in the database."""
-    return category_service.create_category(category)
+    return await category_service.create_category(category)
 
 
 """PUT /category/"""
@@ -40,7 +50,7 @@ async def post_category(category: Category):
 @router.put("/category/{category_id}", summary="Update a category")
 async def put_category(category_id: int, category: Category):
     """Update a category in the database."""
-    update_result = category_service.update_category(category_id, category)
+    update_result = await category_service.update_category(category_id, category)
     message = update_result["message"]
 
     if "does not exist" in message:
@@ -59,4 +69,4 @@ async def put_category(category_id: int, category: Category):
 @router.delete("/category/{category_id}", summary="Delete a category")
 async def delete_category(category_id: int):
     """Delete a category from the database."""
-    return category_service.delete_category(category_id)
+    return await category_service.delete_category(category_id)
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from database import update_pool_metrics
+from utils.metrics import render_metrics
+
+router = APIRouter()
+
+"""GET routes"""
+
+
+@router.get("/metrics", response_class=PlainTextResponse, summary="Get Prometheus metrics")
+async def get_metrics():
+    """Return the query, connection pool and request metrics in the Prometheus text format."""
+    update_pool_metrics()
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
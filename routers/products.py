@@ -1,60 +1,235 @@
-from typing import List
-from fastapi import APIRouter, HTTPException, UploadFile, File, Query
-from models import ProductCreate, ProductUpdate, ProductInDB
-from services import product_service, csv_database_service
+from decimal import Decimal
+from typing import List, Literal, Optional, Union
+from uuid import UUID
+from fastapi import APIRouter, HTTPException, UploadFile, File, Query, Body, Request, Response
+from fastapi.responses import StreamingResponse
+from models import ProductCreate, ProductUpdate, ProductInDB, ProductPage, ProductSearchResult, ProductBatchUpdate, \
+    BatchItemResult, ImportJob, CategoryStats, SubcategoryStats, ProductQueryPage
+from services import product_service, csv_database_service, product_batch_service, csv_import_job_service, \
+    export_service, stats_service
 from utils.apiResponse import ApiResponse
+from utils.etag import make_etag, not_modified
+from utils.streaming import iter_ndjson, iter_json_array
 
 router = APIRouter()
 
+VALIDATE_QUERY = Query(False, description="Build and validate a model per row instead of encoding rows directly")
+IN_STOCK_QUERY = Query(None, description="true: only products with units left; false: only sold out products")
+DELETE_MISSING_QUERY = Query(False, description="The file is a full snapshot: delete the products that are not in it")
+
+
+def json_response(content: bytes, etag: str) -> Response:
+    """Wrap JSON bytes produced by the services in a response, bypassing response model validation."""
+    return Response(content=content, media_type="application/json", headers={"ETag": etag})
+
 """GET /products/"""
 
 
 @router.get("/products/", response_model=List[ProductInDB], summary="Get all products")
-async def get_products():
-    """Fetch all products from the database."""
+async def get_products(request: Request, response: Response,
+                       stream: Optional[str] = Query(None, enum=["ndjson", "json"]), validate: bool = VALIDATE_QUERY):
+    """Fetch all products from the database.
+
+    With `stream`, rows are read through a server-side cursor and sent in batches as NDJSON or as a chunked JSON
+    array, so the first bytes go out before the whole catalog has been read. Otherwise rows are encoded straight to
+    JSON unless `validate` is set.
+    """
+    etag = make_etag("products", stream, await product_service.fetch_products_version())
+    if cached := not_modified(request, etag):
+        return cached
+    headers = {"ETag": etag}
+    if stream == "ndjson":
+        return StreamingResponse(iter_ndjson(product_service.stream_products()), media_type="application/x-ndjson",
+                                 headers=headers)
+    if stream == "json":
+        return StreamingResponse(iter_json_array(product_service.stream_products()), media_type="application/json",
+                                 headers=headers)
+    response.headers.update(headers)
     try:
-        products = product_service.fetch_products()
+        if not validate:
+            return json_response(await product_service.fetch_products(encoded=True), etag)
+        products = await product_service.fetch_products()
         return products
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/product/{id}", response_model=ProductInDB, summary="Get a product by ID")
-async def get_product(id: int):
+async def get_product(id: int, request: Request, response: Response):
     """Fetch a single product by its ID from the database."""
-    product = product_service.fetch_product(id)
+    updated_at = await product_service.fetch_product_version(id)
+    if updated_at is not None:
+        etag = make_etag("product", id, updated_at)
+        if cached := not_modified(request, etag):
+            return cached
+        response.headers["ETag"] = etag
+    product = await product_service.fetch_product(id)
     if product is None:
         raise HTTPException(status_code=404, detail=f"Product {id} not found")
     return product
 
 
-@router.get("/products/orderby/", summary="Get products ordered by price")
-async def get_products_orderby(orderby: str = Query(None, enum=["asc", "desc"])):
-    """Fetch all products ordered by price from the database."""
+@router.get("/products/ids/", response_model=List[ProductInDB], summary="Get several products by ID")
+async def get_products_by_ids(request: Request, response: Response, ids: List[int] = Query(...),
+                              validate: bool = VALIDATE_QUERY):
+    """Fetch several products by their IDs with a single query, in the order requested."""
+    etag = make_etag("products", ids, await product_service.fetch_products_version_by_ids(ids))
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    try:
+        if not validate:
+            return json_response(await product_service.fetch_products_by_ids(ids, encoded=True), etag)
+        return await product_service.fetch_products_by_ids(ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/products/orderby/", summary="Get products ordered by name")
+async def get_products_orderby(request: Request, response: Response,
+                               orderby: str = Query(None, enum=["asc", "desc"]), validate: bool = VALIDATE_QUERY):
+    """Fetch all products ordered by name from the database."""
+    etag = make_etag("orderby", orderby, await product_service.fetch_listing_version())
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
     try:
-        return product_service.fetch_products_orderby(orderby)
+        if not validate:
+            return json_response(await product_service.fetch_products_orderby(orderby, encoded=True), etag)
+        return await product_service.fetch_products_orderby(orderby)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/products/contain/", summary="Get products that contain a string")
-async def get_products_contain(name: str):
+async def get_products_contain(name: str, request: Request, response: Response, validate: bool = VALIDATE_QUERY):
     """Fetch all products that contain a given string in their name from the database."""
+    etag = make_etag("contain", name, await product_service.fetch_listing_version())
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
     try:
-        return product_service.fetch_products_contain(name)
+        if not validate:
+            return json_response(await product_service.fetch_products_contain(name, encoded=True), etag)
+        return await product_service.fetch_products_contain(name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/products/search/", response_model=List[ProductSearchResult], summary="Search products")
+async def get_products_search(q: str, request: Request, response: Response, limit: int = Query(20, ge=1, le=100),
+                              offset: int = Query(0, ge=0, le=1000)):
+    """Search products by name, description and company, ordered by relevance."""
+    etag = make_etag("search", q, limit, offset, await product_service.fetch_catalog_version())
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    try:
+        return await product_service.search_products(q, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/products/skip_limit/", summary="Get a range of products")
-async def get_products_skip_limit(skip: int, limit: int):
+async def get_products_skip_limit(skip: int, limit: int, request: Request, response: Response,
+                                  validate: bool = VALIDATE_QUERY):
     """Fetch a range of products with skip and limit from the database."""
+    etag = make_etag("skip_limit", skip, limit, await product_service.fetch_listing_version())
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
     try:
-        return product_service.fetch_products_skip_limit(skip, limit)
+        if not validate:
+            return json_response(await product_service.fetch_products_skip_limit(skip, limit, encoded=True), etag)
+        return await product_service.fetch_products_skip_limit(skip, limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/products/cursor/", response_model=ProductPage, summary="Get a page of products using a cursor")
+async def get_products_cursor(request: Request, response: Response, limit: int = Query(50, ge=1, le=500),
+                              cursor: Optional[str] = None, order: str = Query("id", enum=["id", "name"])):
+    """Fetch a page of products with keyset pagination; pass the returned next_cursor to get the next page."""
+    etag = make_etag("cursor", limit, cursor, order, await product_service.fetch_catalog_version())
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    try:
+        return await product_service.fetch_products_page(limit, cursor, order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/stats/", response_model=Union[List[SubcategoryStats], List[CategoryStats]],
+            summary="Get catalog statistics per category or subcategory")
+async def get_stats(request: Request, response: Response,
+                    group_by: Literal["category", "subcategory"] = Query("category")):
+    """Fetch the product count, total units, min/avg/max price and stock value (price x units) per category or
+    subcategory, from rollups kept up to date on every product write."""
+    etag = make_etag("stats", group_by, await stats_service.fetch_stats_version())
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    if group_by == "subcategory":
+        return await stats_service.fetch_subcategory_stats()
+    return await stats_service.fetch_category_stats()
+
+
+@router.get("/products/query/", response_model=ProductQueryPage, summary="Filter and sort products")
+async def get_products_query(request: Request, response: Response, limit: int = Query(50, ge=1, le=500),
+                             cursor: Optional[str] = None,
+                             sort: Literal["name", "price", "updated_at"] = Query("name"),
+                             direction: Literal["asc", "desc"] = Query("asc"),
+                             category_id: Optional[int] = None, subcategory_id: Optional[int] = None,
+                             company: Optional[str] = None, price_min: Optional[Decimal] = Query(None, ge=0),
+                             price_max: Optional[Decimal] = Query(None, ge=0),
+                             in_stock: Optional[bool] = IN_STOCK_QUERY):
+    """Fetch a page of the products matching every given filter, sorted by name, price or updated_at.
+
+    Pass the returned next_cursor, with the same filters and sort, to get the next page.
+    """
+    filters = {"category_id": category_id, "subcategory_id": subcategory_id, "company": company,
+               "price_min": price_min, "price_max": price_max, "in_stock": in_stock}
+    etag = make_etag("query", limit, cursor, sort, direction, *filters.values(),
+                     await product_service.fetch_catalog_version())
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    try:
+        return await product_service.query_products(limit, cursor, sort, direction, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+@router.get("/export/", summary="Export the catalog")
+async def export_catalog(file_format: Literal["csv", "arrow", "parquet"] = Query("csv", alias="format"),
+                         gzip: bool = Query(False, description="Compress the CSV export with gzip")):
+    """Stream the whole catalog as a file download, in constant memory.
+
+    The CSV export comes straight from `COPY ... TO STDOUT` with the columns of `llista_productes.csv`. The Arrow
+    (IPC stream) and Parquet exports need the optional `pyarrow` package.
+    """
+    media_type, extension = EXPORT_FORMATS[file_format]
+    if file_format == "csv":
+        content = export_service.stream_catalog_csv()
+        if gzip:
+            content = export_service.gzip_chunks(content)
+            media_type, extension = "application/gzip", "csv.gz"
+    elif export_service.pyarrow is None:
+        raise HTTPException(status_code=501, detail="The Arrow and Parquet exports require the pyarrow package.")
+    else:
+        content = export_service.stream_catalog_columnar(file_format)
+    headers = {"Content-Disposition": f'attachment; filename="catalog.{extension}"'}
+    return StreamingResponse(content, media_type=media_type, headers=headers)
+
+
 """POST /products/"""
 
 
@@ -62,22 +237,65 @@ async def get_products_skip_limit(skip: int, limit: int):
 async def post_product(product: ProductCreate):
     """Create a new product in the database."""
     try:
-        product_service.create_product(product)
+        await product_service.create_product(product)
         return ApiResponse(status=200, message="Product created successfully", data=product).convert_to_dict()
     except Exception as e:
         return ApiResponse(status=400, message=str(e), data=False).convert_to_dict()
 
 
+@router.post("/products/batch/", response_model=List[BatchItemResult], summary="Create many products")
+async def post_products_batch(products: List[ProductCreate]):
+    """Create many products in a single transaction and return a result per item."""
+    try:
+        return await product_batch_service.create_products(products)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.post("/loadProducts/", summary="Upload a CSV file")
-async def upload_csv(file: UploadFile = File(...)):
-    """Upload a CSV file and load its data into the database."""
+async def upload_csv(file: UploadFile = File(...), delete_missing: bool = DELETE_MISSING_QUERY):
+    """Upload a CSV file and load its data into the database.
+
+    Only rows whose content changed are written; the result counts the inserted, updated and unchanged rows of every
+    table, and the deleted products when `delete_missing` is set.
+    """
     try:
-        await csv_database_service.load_data_from_csv(file)
-        return {"message": "File uploaded successfully and data loaded into the database."}
+        result = await csv_database_service.load_data_from_csv(file, delete_missing)
+        return {"message": "File uploaded successfully and data loaded into the database.", "result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/import/", status_code=202, summary="Upload a CSV file to import in the background")
+async def start_import(file: UploadFile = File(...),
+                       workers: int = Query(1, ge=1, description="Processes loading the file in parallel"),
+                       delete_missing: bool = DELETE_MISSING_QUERY):
+    """Store the CSV file and import it in a background worker; returns the id of the job to follow its progress.
+
+    With several `workers` the file is split by category and the partitions are validated and loaded in parallel,
+    each over its own connection.
+    """
+    job_id = await csv_import_job_service.create_job(file, workers, delete_missing)
+    return {"message": "Import job queued.", "job_id": job_id}
+
+
+@router.get("/import/{job_id}", response_model=ImportJob, summary="Get the progress of a CSV import job")
+async def get_import(job_id: UUID):
+    """Return the rows processed, the rows per second, the rejected rows and the status of an import job."""
+    job = await csv_import_job_service.fetch_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Import job {job_id} not found")
+    return job
+
+
+@router.post("/import/{job_id}/resume", status_code=202, summary="Resume a failed CSV import job")
+async def resume_import(job_id: UUID):
+    """Queue a failed job again; it continues after the last batch it committed."""
+    if not await csv_import_job_service.resume_job(job_id):
+        raise HTTPException(status_code=409, detail=f"Import job {job_id} does not exist or is not resumable")
+    return {"message": "Import job resumed.", "job_id": str(job_id)}
+
+
 """PUT /products/"""
 
 
@@ -85,12 +303,21 @@ async def upload_csv(file: UploadFile = File(...)):
 async def put_product(id: int, product: ProductUpdate):
     """Update an existing product in the database."""
     try:
-        product_service.update_product(id, product)
+        await product_service.update_product(id, product)
         return ApiResponse(status=200, message="Product updated successfully", data=product).convert_to_dict()
     except Exception as e:
         return ApiResponse(status=400, message=str(e), data=False).convert_to_dict()
 
 
+@router.put("/products/batch/", response_model=List[BatchItemResult], summary="Update many products")
+async def put_products_batch(products: List[ProductBatchUpdate]):
+    """Update many products in a single transaction and return a result per item."""
+    try:
+        return await product_batch_service.update_products(products)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 """DELETE /products/"""
 
 
@@ -98,7 +325,16 @@ async def put_product(id: int, product: ProductUpdate):
 async def delete_product(id: int):
     """Delete a product by its ID from the database."""
     try:
-        product_service.delete_product(id)
+        await product_service.delete_product(id)
         return ApiResponse(status=200, message="Product deleted successfully", data=True).convert_to_dict()
     except Exception as e:
         return ApiResponse(status=400, message=str(e), data=False).convert_to_dict()
+
+
+@router.delete("/products/batch/", response_model=List[BatchItemResult], summary="Delete many products")
+async def delete_products_batch(ids: List[int] = Body(...)):
+    """Delete many products by their IDs in a single statement and return a result per item."""
+    try:
+        return await product_batch_service.delete_products(ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
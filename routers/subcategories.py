@@ -1,6 +1,7 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from models import Subcategory
 from services import subcategory_service
+from utils.etag import make_etag, not_modified
 
 router = APIRouter()
 
@@ -8,20 +9,29 @@ router = APIRouter()
 
 
 @router.get("/subcategories/", summary="Get all subcategories")
-async def get_all_subcategories():
+async def get_all_subcategories(request: Request, response: Response):
     """Fetch all subcategories from the database."""
-    subcategories = subcategory_service.fetch_subcategories()
+    subcategories = await subcategory_service.fetch_subcategories()
     if not subcategories:
         raise HTTPException(status_code=404, detail="No subcategories found")
+    # Derived from the rows served, so the ETag costs no query on a cache hit and always matches the body.
+    etag = make_etag("subcategories", subcategories)
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
     return subcategories
 
 
 @router.get("/subcategory/{subcategory_id}", summary="Get a subcategory by ID")
-async def get_subcategory_by_id(subcategory_id: int):
+async def get_subcategory_by_id(subcategory_id: int, request: Request, response: Response):
     """Fetch a subcategory by its ID from the database."""
-    subcategory = subcategory_service.fetch_subcategory(subcategory_id)
+    subcategory = await subcategory_service.fetch_subcategory(subcategory_id)
     if not subcategory:
         raise HTTPException(status_code=404, detail=f"Subcategory {subcategory_id} not found")
+    etag = make_etag("subcategory", subcategory_id, subcategory)
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
     return subcategory
 
 
@@ -31,7 +41,7 @@ async def get_subcategory_by_id(subcategory_id: int):
 @router.post("/subcategory/", summary="Create a new subcategory")
 async def create_subcategory(subcategory: Subcategory):
     """Create a new subcategory in the database."""
-    created_subcategory = subcategory_service.create_subcategory(subcategory)
+    created_subcategory = await subcategory_service.create_subcategory(subcategory)
     if not created_subcategory:
         raise HTTPException(status_code=400, detail="Failed to create subcategory")
     return {"message": "Subcategory created successfully"}
@@ -43,7 +53,7 @@ async def create_subcategory(subcategory: Subcategory):
 @router.put("/subcategory/{subcategory_id}", summary="Update a subcategory")
 async def update_subcategory(subcategory_id: int, subcategory: Subcategory):
     """Update a subcategory in the database."""
-    updated_subcategory = subcategory_service.update_subcategory(subcategory_id, subcategory)
+    updated_subcategory = await subcategory_service.update_subcategory(subcategory_id, subcategory)
     if not updated_subcategory:
         raise HTTPException(status_code=500, detail="Failed to update subcategory.")
     return updated_subcategory
@@ -55,7 +65,7 @@ async def update_subcategory(subcategory_id: int, subcategory: Subcategory):
 @router.delete("/subcategory/{subcategory_id}", summary="Delete a subcategory")
 async def delete_subcategory(subcategory_id: int):
     """Delete a subcategory from the database."""
-    response = subcategory_service.delete_subcategory(subcategory_id)
+    response = await subcategory_service.delete_subcategory(subcategory_id)
     if response['status'] == "failed":
         raise HTTPException(status_code=404, detail=response['message'])
     return {"message": response['message']}
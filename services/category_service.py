@@ -1,7 +1,11 @@
 from psycopg import Error, DatabaseError, sql
 
-from database import get_connection
+from database import execute_query, execute_shared_query
 from models import Category
+from services import change_listener
+from services.subcategory_service import subcategory_cache
+from utils.cache import TTLCache
+from utils.singleflight import SingleFlight
 
 FETCH_CATEGORIES_SQL = sql.SQL("SELECT * FROM public.category")
 FETCH_CATEGORY_SQL = sql.SQL("SELECT * FROM public.category WHERE category_id = %s")
@@ -10,45 +14,34 @@ INSERT_CATEGORY_SQL = sql.SQL("""
     VALUES (%s, %s, NOW(), NOW())
 """)
 UPDATE_CATEGORY_SQL = sql.SQL("""
-    UPDATE public.category SET name = %s, updated_at = NOW() WHERE category_id = %s
+    UPDATE public.category SET name = %s, updated_at = NOW() WHERE category_id = %s RETURNING category_id
 """)
-DELETE_CATEGORY_SQL = sql.SQL("DELETE FROM public.category WHERE category_id = %s")
+DELETE_CATEGORY_SQL = sql.SQL("DELETE FROM public.category WHERE category_id = %s RETURNING category_id")
 
+ALL_CATEGORIES = "all"
+category_cache = TTLCache("categories")
+read_queries = SingleFlight("categories")
 
-def execute_query(query: str, params: tuple = None):
-    """Execute a query and return the results."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            if cursor.description:
-                results = cursor.fetchall()
-            else:
-                results = cursor.rowcount
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn is not None and not conn.closed:
-            conn.close()
-    return results
-
-
-def fetch_categories():
+
+async def fetch_categories():
     """Fetch all categories from the database."""
-    return execute_query(FETCH_CATEGORIES_SQL)
+    return await category_cache.get_or_load(ALL_CATEGORIES,
+                                             lambda: execute_shared_query(read_queries, FETCH_CATEGORIES_SQL))
 
 
-def fetch_category(category_id: int):
+async def fetch_category(category_id: int):
     """Fetch a category by its ID."""
-    return execute_query(FETCH_CATEGORY_SQL, (category_id,))
+    return await category_cache.get_or_load(category_id,
+                                             lambda: execute_shared_query(read_queries, FETCH_CATEGORY_SQL,
+                                                                          (category_id,)))
 
 
-def create_category(category: Category):
+async def create_category(category: Category):
     """Create a new category in the database."""
     try:
-        execute_query(INSERT_CATEGORY_SQL, (category.category_id, category.name))
+        await execute_query(INSERT_CATEGORY_SQL, (category.category_id, category.name))
+        category_cache.invalidate(category.category_id, ALL_CATEGORIES)
+        read_queries.forget()
         return {"message": "Category created successfully"}
     except DatabaseError as e:
         return {"message": f"Failed to create category: {str(e)}"}
@@ -56,37 +49,54 @@ def create_category(category: Category):
         return {"message": f"Unexpected error occurred: {str(e)}"}
 
 
-def update_category(category_id: int, category: Category):
+async def update_category(category_id: int, category: Category):
     """Update an existing category in the database."""
-    if not category_exists(category_id):
+    updated = await execute_query(UPDATE_CATEGORY_SQL, (category.name, category_id))
+    if not updated:
         return {"message": f"Category with id {category_id} does not exist"}
 
-    rows_affected = execute_query(UPDATE_CATEGORY_SQL, (category.name, category_id))
-    if rows_affected > 0:
-        return {"message": "Category updated successfully"}
-    else:
-        return {"message": "No changes were made"}
+    category_cache.invalidate(category_id, ALL_CATEGORIES)
+    read_queries.forget()
+    return {"message": "Category updated successfully"}
 
 
-def delete_category(category_id: int):
+async def delete_category(category_id: int):
     """Delete a category from the database."""
-    if not category_exists(category_id):
-        return {"message": f"Category with id {category_id} does not exist"}
-
     try:
-        execute_query(DELETE_CATEGORY_SQL, (category_id,))
-        return {"message": "Category deleted successfully"}
+        deleted = await execute_query(DELETE_CATEGORY_SQL, (category_id,))
     except Error as e:
         return {"message": f"Failed to delete category with id {category_id}: {str(e)}"}
+    if not deleted:
+        return {"message": f"Category with id {category_id} does not exist"}
 
+    category_cache.invalidate(category_id, ALL_CATEGORIES)
+    read_queries.forget()
+    # Subcategories may have been removed by a cascading foreign key.
+    subcategory_cache.clear()
+    return {"message": "Category deleted successfully"}
 
-def category_exists(category_id: int):
+
+async def category_exists(category_id: int):
     """Check if a category exists in the database."""
-    return bool(fetch_category(category_id))
+    return bool(await fetch_category(category_id))
 
 
 async def create_or_update_category(category: Category):
-    if not category_exists(category.category_id):
-        create_category(category)
+    if not await category_exists(category.category_id):
+        await create_category(category)
+    else:
+        await update_category(category.category_id, category)
+
+
+def apply_category_change(category_id: int, operation: str):
+    """Invalidate the cached entries of a category changed by any worker."""
+    if category_id is None:
+        category_cache.clear()
     else:
-        update_category(category.category_id, category)
+        category_cache.invalidate(category_id, ALL_CATEGORIES)
+    read_queries.forget()
+    if operation == "DELETE":
+        subcategory_cache.clear()
+
+
+change_listener.subscribe("category", apply_category_change)
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from psycopg import AsyncConnection
+
+from database import DATABASE_CONNECTION_STRING
+from utils.cache import caches
+
+CHANNEL = "catalog_changes"
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+logger = logging.getLogger(__name__)
+
+handlers: Dict[str, List[Callable[[Optional[int], str], None]]] = defaultdict(list)
+listener_task: Optional[asyncio.Task] = None
+
+
+def subscribe(table: str, handler: Callable[[Optional[int], str], None]):
+    """Register a handler called with (id, operation) for every change published for the table.
+
+    The id is None when the change touched too many rows to be published one by one.
+    """
+    handlers[table].append(handler)
+
+
+def dispatch(payload: str):
+    """Decode a notification payload and call the handlers of its table."""
+    try:
+        change = json.loads(payload)
+        table = change["table"]
+        changed_id = int(change["id"]) if change["id"] is not None else None
+        operation = change["operation"]
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Ignoring malformed catalog change notification: %r", payload)
+        return
+    for handler in handlers[table]:
+        handler(changed_id, operation)
+
+
+async def listen():
+    """Listen for catalog changes and apply them until cancelled, reconnecting when the connection is lost."""
+    delay = RECONNECT_DELAY
+    while True:
+        try:
+            async with await AsyncConnection.connect(DATABASE_CONNECTION_STRING, autocommit=True) as conn:
+                await conn.execute(f"LISTEN {CHANNEL}")
+                # Changes published while we were not listening are lost, so start from empty caches.
+                for cache in caches:
+                    cache.clear()
+                delay = RECONNECT_DELAY
+                async for notify in conn.notifies():
+                    dispatch(notify.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Catalog change listener disconnected (%s), retrying in %.0fs", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+def start():
+    """Start the change listener in the background."""
+    global listener_task
+    listener_task = asyncio.create_task(listen())
+
+
+async def stop():
+    """Stop the background change listener."""
+    global listener_task
+    if listener_task is not None:
+        listener_task.cancel()
+        try:
+            await listener_task
+        except asyncio.CancelledError:
+            pass
+        listener_task = None
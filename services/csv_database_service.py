@@ -1,91 +1,260 @@
+import codecs
+from typing import AsyncIterator, BinaryIO, Iterator, List, Optional, Tuple
+
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from database import get_connection
 import csv
 from models import Category, ProductCreateCSV, Subcategory
+from services import category_service, subcategory_service, product_service
 
+CSV_COLUMNS = 10
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
 
-def execute_query(query: str, params: tuple = None):
-    """Execute a query and return the results."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            if cursor.description:
-                results = cursor.fetchall()
-            else:
-                results = cursor.rowcount
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn is not None and not conn.closed:
-            conn.close()
-    return results
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE csv_import_staging (
+        line_number integer,
+        category_id integer,
+        category_name text,
+        subcategory_id integer,
+        subcategory_name text,
+        product_id integer,
+        name text,
+        description text,
+        company text,
+        price double precision,
+        units integer
+    ) ON COMMIT DROP
+"""
+COPY_STAGING_SQL = """
+    COPY csv_import_staging (line_number, category_id, category_name, subcategory_id, subcategory_name, product_id,
+                             name, description, company, price, units) FROM STDIN
+"""
+# Rows whose content did not change are left alone: no new row version, no WAL and no updated_at churn.
+UPSERT_CATEGORIES_SQL = """
+    INSERT INTO public.category AS target (category_id, name, created_at, updated_at)
+    SELECT DISTINCT ON (category_id) category_id, category_name, NOW(), NOW()
+    FROM csv_import_staging
+    ORDER BY category_id, line_number DESC
+    ON CONFLICT (category_id) DO UPDATE SET name = EXCLUDED.name, updated_at = NOW()
+    WHERE target.name IS DISTINCT FROM EXCLUDED.name
+    RETURNING (xmax = 0) AS inserted
+"""
+UPSERT_SUBCATEGORIES_SQL = """
+    INSERT INTO public.subcategory AS target (subcategory_id, name, category_id, created_at, updated_at)
+    SELECT DISTINCT ON (subcategory_id) subcategory_id, subcategory_name, category_id, NOW(), NOW()
+    FROM csv_import_staging
+    ORDER BY subcategory_id, line_number DESC
+    ON CONFLICT (subcategory_id) DO UPDATE SET name = EXCLUDED.name, category_id = EXCLUDED.category_id,
+                                               updated_at = NOW()
+    WHERE (target.name, target.category_id) IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.category_id)
+    RETURNING (xmax = 0) AS inserted
+"""
+UPSERT_PRODUCTS_SQL = """
+    INSERT INTO public.product AS target (product_id, name, description, company, price, units, subcategory_id,
+                                          created_at, updated_at)
+    SELECT DISTINCT ON (product_id) product_id, name, description, company, price, units, subcategory_id, NOW(), NOW()
+    FROM csv_import_staging
+    ORDER BY product_id, line_number DESC
+    ON CONFLICT (product_id) DO UPDATE SET name = EXCLUDED.name, description = EXCLUDED.description,
+                                           company = EXCLUDED.company, price = EXCLUDED.price,
+                                           units = EXCLUDED.units, subcategory_id = EXCLUDED.subcategory_id,
+                                           updated_at = NOW()
+    WHERE (target.name, target.description, target.company, target.price, target.units, target.subcategory_id)
+          IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.description, EXCLUDED.company, EXCLUDED.price, EXCLUDED.units,
+                            EXCLUDED.subcategory_id)
+    RETURNING (xmax = 0) AS inserted
+"""
+COUNT_STAGED_SQL = """
+    SELECT count(DISTINCT category_id), count(DISTINCT subcategory_id), count(DISTINCT product_id)
+    FROM csv_import_staging
+"""
+CREATE_SNAPSHOT_SQL = "CREATE TEMP TABLE csv_import_snapshot (product_id integer) ON COMMIT DROP"
+COPY_SNAPSHOT_SQL = "COPY csv_import_snapshot (product_id) FROM STDIN"
+SNAPSHOT_STAGED_SQL = "INSERT INTO csv_import_snapshot SELECT product_id FROM csv_import_staging"
+DELETE_MISSING_PRODUCTS_SQL = """
+    DELETE FROM public.product AS p
+    WHERE NOT EXISTS (SELECT 1 FROM csv_import_snapshot s WHERE s.product_id = p.product_id)
+"""
+UNIDENTIFIED_ROWS_ERROR = "Products missing from the file were not deleted: {} rejected rows have no valid product ID"
 
 
-def create_or_update_category(category: Category):
-    """Create or update a category in the database."""
-    query = "INSERT INTO public.category (category_id, name, created_at, updated_at) VALUES (%s, %s, NOW(), NOW()) ON CONFLICT (category_id) DO UPDATE SET name = %s, updated_at = NOW()"
-    params = (category.category_id, category.name, category.name)
-    execute_query(query, params)
+def parse_row(line_number: int, row: list) -> tuple:
+    """Validate a CSV row and return it as a staging table record."""
+    if len(row) != CSV_COLUMNS:
+        raise ValueError(f"Expected {CSV_COLUMNS} columns, got {len(row)}")
+    category = Category(
+        category_id=int(row[0]),
+        name=row[1]
+    )
+    subcategory = Subcategory(
+        subcategory_id=int(row[2]),
+        name=row[3],
+        category_id=category.category_id
+    )
+    product = ProductCreateCSV(
+        product_id=int(row[4]),
+        name=row[5],
+        description=row[6],
+        company=row[7],
+        price=float(row[8]),
+        units=int(row[9]),
+        subcategory_id=subcategory.subcategory_id
+    )
+    return (line_number, category.category_id, category.name, subcategory.subcategory_id, subcategory.name,
+            product.product_id, product.name, product.description, product.company, product.price, product.units)
 
 
-def create_or_update_subcategory(subcategory: Subcategory):
-    """Create or update a subcategory in the database."""
-    query = "INSERT INTO public.subcategory (subcategory_id, name, category_id, created_at, updated_at) VALUES (%s, %s, %s, NOW(), NOW()) ON CONFLICT (subcategory_id) DO UPDATE SET name = %s, category_id = %s, updated_at = NOW()"
-    params = (subcategory.subcategory_id, subcategory.name, subcategory.category_id, subcategory.name,
-              subcategory.category_id)
-    execute_query(query, params)
+def count_upserted(rows: list, staged: int) -> dict:
+    """Split the rows returned by an upsert into inserted and updated counts; the other staged rows were unchanged."""
+    inserted = sum(1 for row in rows if row[0])
+    return {"inserted": inserted, "updated": len(rows) - inserted, "unchanged": staged - len(rows)}
 
 
-def create_or_update_product(product: ProductCreateCSV):
-    """Create or update a product in the database."""
-    query = "INSERT INTO public.product (product_id, name, description, company, price, units, subcategory_id, created_at, updated_at) VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW()) ON CONFLICT (product_id) DO UPDATE SET name = %s, description = %s, company = %s, price = %s, units = %s, subcategory_id = %s, updated_at = NOW()"
-    params = (product.product_id, product.name, product.description, product.company, product.price, product.units,
-              product.subcategory_id, product.name, product.description, product.company, product.price,
-              product.units, product.subcategory_id)
-    execute_query(query, params)
+def rejected_product_id(row: list) -> Optional[int]:
+    """Return the product ID of a rejected row, or None when it does not have a valid one."""
+    try:
+        return int(row[4])
+    except (IndexError, ValueError):
+        return None
 
 
-async def load_data_from_csv(file: UploadFile):
-    """Load data from a CSV file into the database."""
-    try:
-        contents = await file.read()
-        reader = csv.reader(contents.decode('utf-8').splitlines(), delimiter=',')
-        next(reader)
-        for row in reader:
-            try:
-                category = Category(
-                    category_id=int(row[0]),
-                    name=row[1]
-                )
-                create_or_update_category(category)
-            except Exception as e:
-                raise Exception(f"Error creating or updating category: {e}")
+def describe_error(error: Exception) -> str:
+    """Return a short, single-line description of a row validation error."""
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in error.errors())
+    return str(error)
 
-            try:
-                subcategory = Subcategory(
-                    subcategory_id=int(row[2]),
-                    name=row[3],
-                    category_id=int(row[0])
-                )
-                create_or_update_subcategory(subcategory)
-            except Exception as e:
-                raise Exception(f"Error creating or updating subcategory: {e}")
 
+def read_batch(reader, report: dict, rejected_ids: List[Optional[int]], batch_size: int = BATCH_SIZE) \
+        -> Tuple[List[tuple], bool]:
+    """Read up to batch_size valid staging records from the CSV reader.
+
+    Malformed rows are skipped and recorded in the report with their line number; their product IDs are added to
+    rejected_ids so that a snapshot import does not delete those products. Returns the records and whether the end
+    of the file was reached.
+    """
+    batch = []
+    while len(batch) < batch_size:
+        line_number = reader.line_num + 1
+        try:
+            row = next(reader)
+        except StopIteration:
+            return batch, True
+        except csv.Error as e:
+            row, error = [], e
+        else:
+            if not row:
+                continue
             try:
-                product = ProductCreateCSV(
-                    product_id=int(row[4]),
-                    name=row[5],
-                    description=row[6],
-                    company=row[7],
-                    price=float(row[8]),
-                    units=int(row[9]),
-                    subcategory_id=int(row[2])
-                )
-                create_or_update_product(product)
-            except Exception as e:
-                raise Exception(f"Error creating or updating product: {e}")
+                batch.append(parse_row(line_number, row))
+                continue
+            except ValueError as e:
+                error = e
+        report["rejected"] += 1
+        rejected_ids.append(rejected_product_id(row))
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_number, "error": describe_error(error)})
+    return batch, False
+
+
+def iter_lines(file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Read a binary file in fixed-size chunks, decode it incrementally and yield its lines with their terminator."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="strict")
+    pending = ""
+    while True:
+        chunk = file.read(chunk_size)
+        pending += decoder.decode(chunk, final=not chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+        if not chunk:
+            break
+    if pending:
+        yield pending
+
+
+async def iter_batches(file: UploadFile, report: dict, rejected_ids: List[Optional[int]]) \
+        -> AsyncIterator[List[tuple]]:
+    """Stream the uploaded CSV as batches of validated staging records.
+
+    A single csv.reader finds the record boundaries, so quoted fields may span lines and stray quotes in unquoted
+    fields are read as text, like in the import jobs. The spooled upload is read and parsed in a worker thread one
+    batch at a time, so memory use does not depend on the size of the file.
+    """
+    reader = csv.reader(iter_lines(file.file))
+    await run_in_threadpool(next, reader, None)
+    done = False
+    while not done:
+        batch, done = await run_in_threadpool(read_batch, reader, report, rejected_ids)
+        if batch:
+            yield batch
+
+
+async def bulk_import(batches: AsyncIterator[List[tuple]], report: dict, rejected_ids: List[Optional[int]],
+                      delete_missing: bool = False) -> dict:
+    """COPY the record batches into a staging table and upsert categories, subcategories and products from it.
+
+    Only rows whose content changed are written. With delete_missing the file is a full snapshot of the catalog and
+    products that are not in it are deleted. Everything runs in a single transaction: either the whole import is
+    applied or none of it is.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(CREATE_STAGING_SQL)
+            async with cursor.copy(COPY_STAGING_SQL) as copy:
+                async for batch in batches:
+                    for record in batch:
+                        await copy.write_row(record)
+
+            await cursor.execute(COUNT_STAGED_SQL)
+            staged_categories, staged_subcategories, staged_products = await cursor.fetchone()
+            await cursor.execute(UPSERT_CATEGORIES_SQL)
+            categories = count_upserted(await cursor.fetchall(), staged_categories)
+            await cursor.execute(UPSERT_SUBCATEGORIES_SQL)
+            subcategories = count_upserted(await cursor.fetchall(), staged_subcategories)
+            await cursor.execute(UPSERT_PRODUCTS_SQL)
+            products = count_upserted(await cursor.fetchall(), staged_products)
+
+            products["deleted"] = 0
+            if delete_missing and None in rejected_ids:
+                error = UNIDENTIFIED_ROWS_ERROR.format(rejected_ids.count(None))
+                report["errors"].append({"line": None, "error": error})
+            elif delete_missing:
+                await cursor.execute(CREATE_SNAPSHOT_SQL)
+                await cursor.execute(SNAPSHOT_STAGED_SQL)
+                async with cursor.copy(COPY_SNAPSHOT_SQL) as copy:
+                    for product_id in rejected_ids:
+                        await copy.write_row((product_id,))
+                await cursor.execute(DELETE_MISSING_PRODUCTS_SQL)
+                products["deleted"] = cursor.rowcount
+
+    return {"categories": categories, "subcategories": subcategories, "products": products}
+
+
+def invalidate_catalog_caches():
+    """Drop the cached categories and subcategories and the shared read queries after an import."""
+    category_service.category_cache.clear()
+    category_service.read_queries.forget()
+    subcategory_service.subcategory_cache.clear()
+    subcategory_service.read_queries.forget()
+    product_service.read_queries.forget()
+
+
+async def load_data_from_csv(file: UploadFile, delete_missing: bool = False) -> dict:
+    """Load data from a CSV file into the database.
+
+    The upload is parsed incrementally, so memory use does not depend on the size of the file.
+    """
+    try:
+        report = {"rejected": 0, "errors": []}
+        rejected_ids = []
+        result = await bulk_import(iter_batches(file, report, rejected_ids), report, rejected_ids, delete_missing)
+        invalidate_catalog_caches()
+        result.update(report)
+        return result
     except Exception as e:
         raise Exception("Error loading data from CSV", e)
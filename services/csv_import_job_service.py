@@ -0,0 +1,484 @@
+import asyncio
+import csv
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+import psycopg
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from psycopg.types.json import Jsonb
+
+from database import DATABASE_CONNECTION_STRING, execute_query
+from services.csv_database_service import CREATE_STAGING_SQL, COPY_STAGING_SQL, UPSERT_CATEGORIES_SQL, \
+    UPSERT_SUBCATEGORIES_SQL, UPSERT_PRODUCTS_SQL, COUNT_STAGED_SQL, CREATE_SNAPSHOT_SQL, COPY_SNAPSHOT_SQL, \
+    DELETE_MISSING_PRODUCTS_SQL, UNIDENTIFIED_ROWS_ERROR, MAX_REPORTED_ERRORS, parse_row, count_upserted, \
+    describe_error, rejected_product_id, invalidate_catalog_caches
+
+IMPORT_DIR = os.getenv("IMPORT_DIR", os.path.join(tempfile.gettempdir(), "catalog-imports"))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "10000"))
+IMPORT_STALE_SECONDS = int(os.getenv("IMPORT_STALE_SECONDS", "300"))
+MAX_IMPORT_WORKERS = os.cpu_count() or 1
+# A running job touches updated_at this often, in every phase, so that it only looks stale once its process is gone.
+IMPORT_HEARTBEAT_SECONDS = max(IMPORT_STALE_SECONDS / 5, 1)
+
+TAXONOMY_UPSERTS = (("categories", UPSERT_CATEGORIES_SQL), ("subcategories", UPSERT_SUBCATEGORIES_SQL))
+PRODUCT_UPSERTS = (("products", UPSERT_PRODUCTS_SQL),)
+
+INSERT_JOB_SQL = """
+    INSERT INTO public.csv_import_job (job_id, file_path, workers, delete_missing) VALUES (%s, %s, %s, %s)
+"""
+FETCH_JOB_SQL = """
+    SELECT job_id, status, workers, delete_missing, last_line, rows_processed, rows_rejected, active_seconds, counts,
+           errors, error, created_at, started_at, updated_at, finished_at
+    FROM public.csv_import_job WHERE job_id = %s
+"""
+CLAIM_JOB_SQL = """
+    UPDATE public.csv_import_job SET status = 'running', error = NULL, started_at = NOW(), updated_at = NOW()
+    WHERE job_id = %s AND status = 'queued'
+    RETURNING file_path, last_line, counts, errors, workers, delete_missing
+"""
+REQUEUE_JOB_SQL = """
+    UPDATE public.csv_import_job SET status = 'queued', updated_at = NOW()
+    WHERE job_id = %s
+      AND (status = 'failed'
+           OR (status IN ('queued', 'running') AND updated_at < NOW() - make_interval(secs => %s)))
+    RETURNING job_id
+"""
+HEARTBEAT_SQL = "UPDATE public.csv_import_job SET updated_at = NOW() WHERE job_id = %s AND status = 'running'"
+FETCH_QUEUED_JOBS_SQL = "SELECT job_id FROM public.csv_import_job WHERE status = 'queued' ORDER BY created_at"
+RECORD_BATCH_SQL = """
+    UPDATE public.csv_import_job
+    SET last_line = %s, rows_processed = rows_processed + %s, rows_rejected = rows_rejected + %s,
+        active_seconds = active_seconds + %s, counts = %s, errors = %s, updated_at = NOW()
+    WHERE job_id = %s
+"""
+RESET_JOB_SQL = """
+    UPDATE public.csv_import_job
+    SET last_line = 0, rows_processed = 0, rows_rejected = 0, active_seconds = 0, counts = '{}', errors = '[]'
+    WHERE job_id = %s
+"""
+RECORD_PARTITION_BATCH_SQL = """
+    UPDATE public.csv_import_job
+    SET rows_processed = rows_processed + %s, rows_rejected = rows_rejected + %s,
+        active_seconds = EXTRACT(EPOCH FROM clock_timestamp() - started_at), updated_at = NOW()
+    WHERE job_id = %s
+"""
+RECORD_RESULT_SQL = "UPDATE public.csv_import_job SET counts = %s, errors = %s, updated_at = NOW() WHERE job_id = %s"
+FINISH_JOB_SQL = """
+    UPDATE public.csv_import_job SET status = 'completed', finished_at = NOW(), updated_at = NOW() WHERE job_id = %s
+"""
+FAIL_JOB_SQL = "UPDATE public.csv_import_job SET status = 'failed', error = %s, updated_at = NOW() WHERE job_id = %s"
+
+logger = logging.getLogger(__name__)
+
+executor: Optional[ProcessPoolExecutor] = None
+running_jobs = set()
+submitted_jobs = set()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Return the process pool running the import jobs, creating it on first use."""
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=IMPORT_WORKERS, mp_context=get_context("spawn"))
+    return executor
+
+
+def shutdown():
+    """Stop the import workers. Interrupted jobs stay 'running' and can be resumed once they are stale."""
+    global executor
+    if executor is not None:
+        # Jobs that have not started yet stay 'queued' and are submitted again on the next startup
+        # (ProcessPoolExecutor.shutdown only cancels them itself from 3.9 on).
+        for future in list(submitted_jobs):
+            future.cancel()
+        executor.shutdown(wait=False)
+        executor = None
+
+
+"""Job management (API process)"""
+
+
+async def create_job(file: UploadFile, workers: int = 1, delete_missing: bool = False) -> str:
+    """Store the upload on disk, register an import job for it and start it in the background.
+
+    With more than one worker the file is split by category and the partitions are loaded in parallel. With
+    delete_missing the file is a full snapshot and products that are not in it are deleted at the end.
+    """
+    job_id = str(uuid4())
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_DIR, f"{job_id}.csv")
+
+    def save():
+        with open(path, "wb") as destination:
+            shutil.copyfileobj(file.file, destination)
+
+    await run_in_threadpool(save)
+    await execute_query(INSERT_JOB_SQL, (job_id, path, min(workers, MAX_IMPORT_WORKERS), delete_missing))
+    submit(job_id)
+    return job_id
+
+
+def submit(job_id: str):
+    """Run the job in the worker pool and refresh the caches of this process when it is done."""
+    job = get_executor().submit(run_job, job_id)
+    submitted_jobs.add(job)
+    job.add_done_callback(submitted_jobs.discard)
+    future = asyncio.wrap_future(job)
+
+    async def wait():
+        try:
+            await future
+        except Exception:
+            logger.exception("CSV import job %s crashed", job_id)
+        invalidate_catalog_caches()
+
+    task = asyncio.create_task(wait())
+    running_jobs.add(task)
+    task.add_done_callback(running_jobs.discard)
+
+
+async def fetch_job(job_id: UUID) -> Optional[dict]:
+    """Return the progress of an import job, or None when it does not exist."""
+    rows = await execute_query(FETCH_JOB_SQL, (job_id,))
+    if not rows:
+        return None
+    (job_id, status, workers, delete_missing, last_line, rows_processed, rows_rejected, active_seconds, counts,
+     errors, error, created_at, started_at, updated_at, finished_at) = rows[0]
+    return {
+        "job_id": str(job_id),
+        "status": status,
+        "workers": workers,
+        "delete_missing": delete_missing,
+        "last_committed_line": last_line,
+        "rows_processed": rows_processed,
+        "rows_rejected": rows_rejected,
+        "rows_per_second": round(rows_processed / active_seconds, 1) if active_seconds else 0.0,
+        "result": counts,
+        "errors": errors,
+        "error": error,
+        "created_at": created_at.isoformat(" ", "seconds"),
+        "started_at": started_at.isoformat(" ", "seconds") if started_at else None,
+        "updated_at": updated_at.isoformat(" ", "seconds"),
+        "finished_at": finished_at.isoformat(" ", "seconds") if finished_at else None,
+    }
+
+
+async def submit_queued_jobs():
+    """Submit the jobs left queued by a previous run, e.g. cancelled on shutdown before they started.
+
+    Another instance may submit the same jobs; only the first worker to claim a job runs it.
+    """
+    for (job_id,) in await execute_query(FETCH_QUEUED_JOBS_SQL):
+        submit(str(job_id))
+
+
+async def resume_job(job_id: UUID) -> bool:
+    """Queue a failed (or abandoned) job again; it continues after its last committed batch."""
+    if not await execute_query(REQUEUE_JOB_SQL, (job_id, IMPORT_STALE_SECONDS)):
+        return False
+    submit(str(job_id))
+    return True
+
+
+"""Job execution (worker processes)"""
+
+
+def read_rows(reader) -> Iterator[Tuple[int, List[str], Optional[csv.Error]]]:
+    """Yield (line number, row, error) for every non-empty record of the CSV reader.
+
+    A record the csv module cannot parse (a NUL byte, a field over field_size_limit) comes with an empty row and the
+    error instead of ending the file, as in csv_database_service.read_batch.
+    """
+    while True:
+        line_number = reader.line_num + 1
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield line_number, [], e
+            continue
+        if row:
+            yield line_number, row, None
+
+
+def read_batches(path: str, start_after_line: int, batch_size: int = IMPORT_BATCH_SIZE) \
+        -> Iterator[Tuple[List[tuple], List[dict], int]]:
+    """Yield (records, rejected rows, last line read) batches of the CSV file, skipping lines already imported."""
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        batch, rejected = [], []
+        for line_number, row, error in read_rows(reader):
+            if line_number <= start_after_line:
+                continue
+            if error is None:
+                try:
+                    batch.append(parse_row(line_number, row))
+                except ValueError as e:
+                    error = e
+            if error is not None:
+                rejected.append({"line": line_number, "error": describe_error(error)})
+            if len(batch) >= batch_size:
+                yield batch, rejected, reader.line_num
+                batch, rejected = [], []
+        yield batch, rejected, reader.line_num
+
+
+def import_batch(cursor: psycopg.Cursor, batch: List[tuple], upserts=TAXONOMY_UPSERTS + PRODUCT_UPSERTS) -> dict:
+    """Stage a batch of records with COPY and upsert categories, subcategories and products from it.
+
+    Returns the inserted, updated and unchanged counts of every table.
+    """
+    cursor.execute(CREATE_STAGING_SQL)
+    with cursor.copy(COPY_STAGING_SQL) as copy:
+        for record in batch:
+            copy.write_row(record)
+    cursor.execute(COUNT_STAGED_SQL)
+    staged = dict(zip(("categories", "subcategories", "products"), cursor.fetchone()))
+    counts = {}
+    for table, query in upserts:
+        cursor.execute(query)
+        counts[table] = count_upserted(cursor.fetchall(), staged[table])
+    return counts
+
+
+def add_counts(total: dict, counts: dict):
+    """Add the counts of a batch to the running totals of the job."""
+    for table, values in counts.items():
+        table_total = total.setdefault(table, {})
+        for key, value in values.items():
+            table_total[key] = table_total.get(key, 0) + value
+
+
+@contextmanager
+def heartbeat(job_id: str):
+    """Keep touching the updated_at of a running job from a background thread, over its own connection.
+
+    Batches only commit now and then, and partitioning the file, upserting the taxonomy or deleting missing products
+    commit no progress at all; without the heartbeat a long live job would look stale and could be resumed twice.
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            with psycopg.connect(DATABASE_CONNECTION_STRING, autocommit=True) as conn:
+                while not stop.wait(IMPORT_HEARTBEAT_SECONDS):
+                    conn.execute(HEARTBEAT_SQL, (job_id,))
+        except psycopg.Error:
+            logger.exception("Could not record the heartbeat of CSV import job %s", job_id)
+
+    thread = threading.Thread(target=beat, name=f"import-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job_id: str):
+    """Import the file of a queued job, sequentially or split across worker processes."""
+    with psycopg.connect(DATABASE_CONNECTION_STRING, autocommit=True) as conn:
+        with conn.transaction():
+            claimed = conn.execute(CLAIM_JOB_SQL, (job_id,)).fetchone()
+        if claimed is None:
+            return
+        path, last_line, counts, errors, workers, delete_missing = claimed
+        try:
+            with heartbeat(job_id):
+                counts, errors = import_file(conn, job_id, path, last_line, counts, errors, workers, delete_missing)
+            with conn.transaction():
+                conn.execute(RECORD_RESULT_SQL, (Jsonb(counts), Jsonb(errors), job_id))
+                conn.execute(FINISH_JOB_SQL, (job_id,))
+        except Exception as e:
+            logger.exception("CSV import job %s failed", job_id)
+            with conn.transaction():
+                conn.execute(FAIL_JOB_SQL, (str(e), job_id))
+            return
+    os.remove(path)
+
+
+def import_file(conn: psycopg.Connection, job_id: str, path: str, last_line: int, counts: dict, errors: list,
+                workers: int, delete_missing: bool) -> Tuple[dict, List[dict]]:
+    """Run every phase of the import and return its counts and errors."""
+    if workers > 1:
+        counts, errors = run_parallel(conn, job_id, path, workers)
+    else:
+        run_sequential(conn, job_id, path, last_line, counts, errors)
+    if delete_missing:
+        delete_missing_products(conn, path, counts, errors)
+    return counts, errors
+
+
+def run_sequential(conn: psycopg.Connection, job_id: str, path: str, last_line: int, counts: dict, errors: list):
+    """Import the file after its last committed line, committing every batch together with the job progress."""
+    started = perf_counter()
+    for batch, rejected, line in read_batches(path, last_line):
+        with conn.transaction():
+            with conn.cursor() as cursor:
+                if batch:
+                    add_counts(counts, import_batch(cursor, batch))
+                errors.extend(rejected[:MAX_REPORTED_ERRORS - len(errors)])
+                cursor.execute(RECORD_BATCH_SQL, (line, len(batch), len(rejected), perf_counter() - started,
+                                                  Jsonb(counts), Jsonb(errors), job_id))
+        started = perf_counter()
+
+
+def read_product_ids(path: str) -> Tuple[List[int], int]:
+    """Return the product IDs of every row of the file, valid or not, and the number of rows without one."""
+    product_ids, unidentified = [], 0
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        for _, row, _ in read_rows(reader):
+            product_id = rejected_product_id(row)
+            if product_id is None:
+                unidentified += 1
+            else:
+                product_ids.append(product_id)
+    return product_ids, unidentified
+
+
+def delete_missing_products(conn: psycopg.Connection, path: str, counts: dict, errors: list):
+    """Delete the products that are not in the file, which is a full snapshot of the catalog.
+
+    Nothing is deleted when some row has no valid product ID, since its product could be deleted by mistake.
+    """
+    product_ids, unidentified = read_product_ids(path)
+    products = counts.setdefault("products", {})
+    products["deleted"] = 0
+    if unidentified:
+        errors.append({"line": None, "error": UNIDENTIFIED_ROWS_ERROR.format(unidentified)})
+        return
+    with conn.transaction():
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_SNAPSHOT_SQL)
+            with cursor.copy(COPY_SNAPSHOT_SQL) as copy:
+                for product_id in product_ids:
+                    copy.write_row((product_id,))
+            cursor.execute(DELETE_MISSING_PRODUCTS_SQL)
+            products["deleted"] = cursor.rowcount
+
+
+"""Parallel import (worker processes)"""
+
+
+def partition_file(path: str, partitions: int) \
+        -> Tuple[List[str], Dict[int, tuple], Dict[int, tuple], List[dict]]:
+    """Split the CSV file into one file per partition, keeping all the rows of a category in the same partition.
+
+    Each category goes to the partition with the fewest rows when it is first seen. Partition rows are prefixed with
+    their line number in the original file. Also returns the categories and subcategories of the file, deduplicated
+    (the last valid row wins), as {id: (line, name)} and {id: (line, name, category_id)}. Invalid rows are sent to
+    the first partition, whose worker rejects them; rows the csv module cannot parse have nothing to write and are
+    returned as rejected rows instead.
+    """
+    paths = [f"{path}.part{index}" for index in range(partitions)]
+    files = [open(partition_path, "w", newline="", encoding="utf-8") for partition_path in paths]
+    try:
+        writers = [csv.writer(file) for file in files]
+        sizes = [0] * partitions
+        assigned: Dict[int, int] = {}
+        categories: Dict[int, tuple] = {}
+        subcategories: Dict[int, tuple] = {}
+        rejected = []
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for line_number, row, error in read_rows(reader):
+                if error is not None:
+                    rejected.append({"line": line_number, "error": describe_error(error)})
+                    continue
+                partition = 0
+                try:
+                    # The whole row is validated, as in a sequential import: a rejected row adds no taxonomy.
+                    record = parse_row(line_number, row)
+                except ValueError:
+                    pass
+                else:
+                    _, category_id, category_name, subcategory_id, subcategory_name = record[:5]
+                    categories[category_id] = (line_number, category_name)
+                    subcategories[subcategory_id] = (line_number, subcategory_name, category_id)
+                    partition = assigned.get(category_id)
+                    if partition is None:
+                        partition = assigned[category_id] = sizes.index(min(sizes))
+                sizes[partition] += 1
+                writers[partition].writerow([line_number, *row])
+    finally:
+        for file in files:
+            file.close()
+    return paths, categories, subcategories, rejected
+
+
+def import_taxonomy(conn: psycopg.Connection, categories: Dict[int, tuple], subcategories: Dict[int, tuple]) -> dict:
+    """Upsert the deduplicated categories and subcategories once, before the product partitions are loaded."""
+    with conn.transaction():
+        with conn.cursor() as cursor:
+            batch = [(line, category_id, categories[category_id][1], subcategory_id, name) + (None,) * 6
+                     for subcategory_id, (line, name, category_id) in subcategories.items()]
+            return import_batch(cursor, batch, TAXONOMY_UPSERTS)
+
+
+def read_partition_batches(path: str, batch_size: int = IMPORT_BATCH_SIZE) -> Iterator[Tuple[List[tuple], List[dict]]]:
+    """Yield (records, rejected rows) batches of a partition file written by partition_file."""
+    with open(path, newline="", encoding="utf-8") as file:
+        batch, rejected = [], []
+        for line, *row in csv.reader(file):
+            try:
+                batch.append(parse_row(int(line), row))
+            except ValueError as e:
+                rejected.append({"line": int(line), "error": describe_error(e)})
+            if len(batch) >= batch_size:
+                yield batch, rejected
+                batch, rejected = [], []
+        yield batch, rejected
+
+
+def import_partition(job_id: str, path: str) -> Tuple[dict, List[dict]]:
+    """Validate and load the products of a partition over its own connection; returns its counts and errors."""
+    counts, errors = {}, []
+    with psycopg.connect(DATABASE_CONNECTION_STRING, autocommit=True) as conn:
+        for batch, rejected in read_partition_batches(path):
+            with conn.transaction():
+                with conn.cursor() as cursor:
+                    if batch:
+                        add_counts(counts, import_batch(cursor, batch, PRODUCT_UPSERTS))
+                    cursor.execute(RECORD_PARTITION_BATCH_SQL, (len(batch), len(rejected), job_id))
+            errors.extend(rejected[:MAX_REPORTED_ERRORS - len(errors)])
+    return counts, errors
+
+
+def run_parallel(conn: psycopg.Connection, job_id: str, path: str, workers: int) -> Tuple[dict, List[dict]]:
+    """Split the file by category, upsert its taxonomy once and load the partitions in parallel.
+
+    Partitions commit independently, so a failed parallel job is resumed from the beginning; the upserts make
+    importing the same rows again harmless.
+    """
+    with conn.transaction():
+        conn.execute(RESET_JOB_SQL, (job_id,))
+    paths, categories, subcategories, errors = partition_file(path, workers)
+    try:
+        counts = import_taxonomy(conn, categories, subcategories)
+        if errors:
+            with conn.transaction():
+                conn.execute(RECORD_PARTITION_BATCH_SQL, (0, len(errors), job_id))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            for partition_counts, partition_errors in pool.map(import_partition, [job_id] * workers, paths):
+                add_counts(counts, partition_counts)
+                errors.extend(partition_errors)
+        return counts, sorted(errors, key=lambda error: error["line"])[:MAX_REPORTED_ERRORS]
+    finally:
+        for partition_path in paths:
+            os.remove(partition_path)
@@ -0,0 +1,115 @@
+import zlib
+from typing import AsyncIterator, List
+
+from database import get_connection
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = 10000
+GZIP_LEVEL = 6
+
+# Same columns and order as llista_productes.csv.
+CATALOG_EXPORT_QUERY = """
+    SELECT c.category_id AS id_categoria, c.name AS nom_categoria, s.subcategory_id AS id_subcategoria,
+           s.name AS nom_subcategoria, p.product_id AS id_producto, p.name AS nom_producto,
+           p.description AS descripcion_producto, p.company AS companyia, p.price::double precision AS precio,
+           p.units AS unidades
+    FROM public.product p
+    JOIN public.subcategory s ON p.subcategory_id = s.subcategory_id
+    JOIN public.category c ON s.category_id = c.category_id
+    ORDER BY c.category_id, s.subcategory_id, p.product_id
+"""
+COPY_CATALOG_SQL = f"COPY ({CATALOG_EXPORT_QUERY}) TO STDOUT WITH (FORMAT csv, HEADER)"
+
+if pyarrow is not None:
+    CATALOG_SCHEMA = pyarrow.schema([
+        ("id_categoria", pyarrow.int64()),
+        ("nom_categoria", pyarrow.string()),
+        ("id_subcategoria", pyarrow.int64()),
+        ("nom_subcategoria", pyarrow.string()),
+        ("id_producto", pyarrow.int64()),
+        ("nom_producto", pyarrow.string()),
+        ("descripcion_producto", pyarrow.string()),
+        ("companyia", pyarrow.string()),
+        ("precio", pyarrow.float64()),
+        ("unidades", pyarrow.int64()),
+    ])
+
+
+class ChunkSink:
+    """Write-only file object collecting what pyarrow writes, so it can be sent and dropped batch by batch."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+async def stream_catalog_csv() -> AsyncIterator[bytes]:
+    """Stream the joined catalog as CSV straight from COPY TO STDOUT, in the layout of llista_productes.csv."""
+    async with get_connection() as conn:
+        async with conn.cursor() as cursor:
+            async with cursor.copy(COPY_CATALOG_SQL) as copy:
+                async for data in copy:
+                    yield bytes(data)
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Compress a byte stream incrementally into the gzip format."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def stream_catalog_columnar(file_format: str) -> AsyncIterator[bytes]:
+    """Stream the joined catalog as an Arrow IPC stream or a Parquet file.
+
+    Rows are read through a server-side cursor and converted one batch at a time; every batch becomes an Arrow record
+    batch or a Parquet row group, so memory use does not depend on the size of the catalog.
+    """
+    if pyarrow is None:
+        raise RuntimeError("The Arrow and Parquet exports require the pyarrow package.")
+    sink = ChunkSink()
+    if file_format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(sink, CATALOG_SCHEMA, compression="zstd")
+    else:
+        writer = pyarrow.ipc.new_stream(sink, CATALOG_SCHEMA)
+    async with get_connection() as conn:
+        async with conn.cursor(name="export_catalog") as cursor:
+            await cursor.execute(CATALOG_EXPORT_QUERY)
+            while rows := await cursor.fetchmany(EXPORT_BATCH_SIZE):
+                columns = [list(column) for column in zip(*rows)]
+                writer.write_batch(pyarrow.RecordBatch.from_arrays(
+                    [pyarrow.array(column, type=field.type) for column, field in zip(columns, CATALOG_SCHEMA)],
+                    schema=CATALOG_SCHEMA,
+                ))
+                yield sink.drain()
+    writer.close()
+    yield sink.drain()
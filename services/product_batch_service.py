@@ -0,0 +1,133 @@
+from collections import Counter
+from typing import List
+
+from database import get_connection
+from models import BatchItemResult, ProductBatchUpdate, ProductCreate
+from services.product_service import read_queries
+
+MAX_BATCH_SIZE = 5000
+
+LOCK_SUBCATEGORIES_SQL = """
+    SELECT subcategory_id FROM public.subcategory WHERE subcategory_id = ANY(%s) FOR KEY SHARE
+"""
+INSERT_PRODUCTS_SQL = """
+    WITH items AS (
+        SELECT nextval(pg_get_serial_sequence('public.product', 'product_id')) AS product_id, item.*
+        FROM unnest(%s::int[], %s::text[], %s::text[], %s::text[], %s::float8[], %s::int[], %s::int[])
+            AS item (position, name, description, company, price, units, subcategory_id)
+    ), inserted AS (
+        INSERT INTO public.product (product_id, name, description, company, price, units, subcategory_id, created_at,
+                                    updated_at)
+        SELECT product_id, name, description, company, price, units, subcategory_id, NOW(), NOW()
+        FROM items
+    )
+    SELECT position, product_id FROM items
+"""
+UPDATE_PRODUCTS_SQL = """
+    UPDATE public.product AS product
+    SET name = item.name, description = item.description, company = item.company, price = item.price,
+        units = item.units, subcategory_id = item.subcategory_id, updated_at = NOW()
+    FROM unnest(%s::int[], %s::text[], %s::text[], %s::text[], %s::float8[], %s::int[], %s::int[])
+        AS item (product_id, name, description, company, price, units, subcategory_id)
+    WHERE product.product_id = item.product_id
+    RETURNING product.product_id
+"""
+DELETE_PRODUCTS_SQL = "DELETE FROM public.product WHERE product_id = ANY(%s) RETURNING product_id"
+
+
+def check_batch_size(items: list):
+    """Reject empty batches and batches larger than MAX_BATCH_SIZE."""
+    if not items:
+        raise ValueError("The batch is empty.")
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f"A batch cannot contain more than {MAX_BATCH_SIZE} items.")
+
+
+async def lock_existing_subcategories(cursor, subcategory_ids: set) -> set:
+    """Return which of the subcategories exist, locking them until the end of the transaction."""
+    await cursor.execute(LOCK_SUBCATEGORIES_SQL, (list(subcategory_ids),))
+    return {row[0] for row in await cursor.fetchall()}
+
+
+async def create_products(products: List[ProductCreate]) -> List[BatchItemResult]:
+    """Create many products in one transaction with a single multi-row INSERT."""
+    check_batch_size(products)
+    results = [BatchItemResult(index=index, status="created") for index in range(len(products))]
+    async with get_connection() as conn:
+        async with conn.cursor() as cursor:
+            existing = await lock_existing_subcategories(cursor, {product.subcategory_id for product in products})
+            valid = []
+            for index, product in enumerate(products):
+                if product.subcategory_id in existing:
+                    valid.append((index, product))
+                else:
+                    results[index].status = "failed"
+                    results[index].message = "Subcategory not found"
+
+            if valid:
+                await cursor.execute(INSERT_PRODUCTS_SQL, (
+                    [index for index, _ in valid],
+                    [product.name for _, product in valid],
+                    [product.description for _, product in valid],
+                    [product.company for _, product in valid],
+                    [product.price for _, product in valid],
+                    [product.units for _, product in valid],
+                    [product.subcategory_id for _, product in valid]))
+                for index, product_id in await cursor.fetchall():
+                    results[index].product_id = product_id
+    read_queries.forget()
+    return results
+
+
+async def update_products(products: List[ProductBatchUpdate]) -> List[BatchItemResult]:
+    """Update many products in one transaction with a single UPDATE ... FROM unnest(...)."""
+    check_batch_size(products)
+    results = [BatchItemResult(index=index, product_id=product.product_id, status="updated")
+               for index, product in enumerate(products)]
+    occurrences = Counter(product.product_id for product in products)
+    async with get_connection() as conn:
+        async with conn.cursor() as cursor:
+            existing = await lock_existing_subcategories(cursor, {product.subcategory_id for product in products})
+            valid = []
+            for index, product in enumerate(products):
+                if occurrences[product.product_id] > 1:
+                    results[index].status = "failed"
+                    results[index].message = "Duplicate product id in batch"
+                elif product.subcategory_id not in existing:
+                    results[index].status = "failed"
+                    results[index].message = "Product or subcategory not found"
+                else:
+                    valid.append((index, product))
+
+            if valid:
+                await cursor.execute(UPDATE_PRODUCTS_SQL, (
+                    [product.product_id for _, product in valid],
+                    [product.name for _, product in valid],
+                    [product.description for _, product in valid],
+                    [product.company for _, product in valid],
+                    [product.price for _, product in valid],
+                    [product.units for _, product in valid],
+                    [product.subcategory_id for _, product in valid]))
+                updated = {row[0] for row in await cursor.fetchall()}
+                for index, product in valid:
+                    if product.product_id not in updated:
+                        results[index].status = "failed"
+                        results[index].message = "Product or subcategory not found"
+    read_queries.forget()
+    return results
+
+
+async def delete_products(ids: List[int]) -> List[BatchItemResult]:
+    """Delete many products in one statement."""
+    check_batch_size(ids)
+    async with get_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(DELETE_PRODUCTS_SQL, (ids,))
+            deleted = {row[0] for row in await cursor.fetchall()}
+    read_queries.forget()
+    return [
+        BatchItemResult(index=index, product_id=product_id, status="deleted")
+        if product_id in deleted else
+        BatchItemResult(index=index, product_id=product_id, status="failed", message="Product not found")
+        for index, product_id in enumerate(ids)
+    ]
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+from time import monotonic, perf_counter
+from typing import Optional
+
+from database import execute_query, get_connection
+from services import change_listener
+
+READ_MODEL_REFRESH_SECONDS = float(os.getenv("READ_MODEL_REFRESH_SECONDS", "5"))
+READ_MODEL_MAX_AGE_SECONDS = float(os.getenv("READ_MODEL_MAX_AGE_SECONDS", "300"))
+# Serializes the refreshes of all the workers; any constant shared by every process would do.
+REFRESH_LOCK_ID = 80230001
+
+TRY_LOCK_SQL = "SELECT pg_try_advisory_xact_lock(%s)"
+LOCK_SQL = "SELECT pg_advisory_xact_lock(%s)"
+# The database time at which this worker learnt of a change: now minus the seconds elapsed since the notification.
+CHANGE_SEEN_AT_SQL = "SELECT (clock_timestamp() - make_interval(secs => %s))::timestamp"
+REFRESHED_SINCE_SQL = "SELECT refreshed_at >= %s FROM public.read_model_refresh WHERE name = 'product_listing'"
+# Same figures as product_service.fetch_catalog_version, hashed into a single value.
+SOURCE_VERSION_SQL = """
+    SELECT md5(row(product.*, subcategory.*, category.*)::text)
+    FROM (SELECT max(updated_at), count(*) FROM public.product) AS product,
+         (SELECT max(updated_at), count(*) FROM public.subcategory) AS subcategory,
+         (SELECT max(updated_at), count(*) FROM public.category) AS category
+"""
+FETCH_SOURCE_VERSION_SQL = "SELECT source_version FROM public.read_model_refresh WHERE name = 'product_listing'"
+REFRESH_SQL = "REFRESH MATERIALIZED VIEW CONCURRENTLY public.product_listing"
+RECORD_REFRESH_SQL = """
+    UPDATE public.read_model_refresh SET refreshed_at = NOW(), source_version = %s WHERE name = 'product_listing'
+"""
+FETCH_REFRESHED_AT_SQL = "SELECT refreshed_at FROM public.read_model_refresh WHERE name = 'product_listing'"
+
+logger = logging.getLogger(__name__)
+
+# Monotonic time of the oldest change notification this worker has not handled yet, None when there is none.
+changed_at: Optional[float] = None
+last_refresh = 0.0
+refresh_task: Optional[asyncio.Task] = None
+
+
+def mark_dirty(changed_id: Optional[int], operation: str):
+    """Remember that the catalog changed, so the next tick of the refresh loop refreshes the read model."""
+    global changed_at
+    if changed_at is None:
+        changed_at = monotonic()
+
+
+for table in ("product", "subcategory", "category"):
+    change_listener.subscribe(table, mark_dirty)
+
+
+async def fetch_value(cursor, query: str, params: tuple = None):
+    """Execute a query and return the first column of its first row, or None when it returns no rows."""
+    await cursor.execute(query, params)
+    row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def refresh(wait: bool = True, seen_at: Optional[float] = None) -> bool:
+    """Bring the product listing read model up to date without blocking its readers.
+
+    Every worker is notified of every change, but the view is refreshed once per change: with `seen_at`, the
+    monotonic time at which this worker learnt of the change, the refresh is skipped when another worker already
+    started one after that moment. Without it (the periodic check), the view is refreshed only when the version of
+    the source tables differs from the one it was last refreshed from. refreshed_at, the ETag of the listings, only
+    moves when the view is actually refreshed.
+
+    Only one process refreshes at a time. Without `wait`, returns False at once when another one is refreshing.
+    """
+    global last_refresh
+    async with get_connection() as conn:
+        async with conn.cursor() as cursor:
+            if seen_at is not None:
+                change_seen_at = await fetch_value(cursor, CHANGE_SEEN_AT_SQL, (monotonic() - seen_at,))
+            if wait:
+                await cursor.execute(LOCK_SQL, (REFRESH_LOCK_ID,))
+            elif not await fetch_value(cursor, TRY_LOCK_SQL, (REFRESH_LOCK_ID,)):
+                return False
+            # The refresh transaction started before the lock was granted, so refreshed_at (NOW()) is never later
+            # than the snapshot the view was refreshed from: a refresh recorded after the change includes it.
+            if seen_at is not None and await fetch_value(cursor, REFRESHED_SINCE_SQL, (change_seen_at,)):
+                last_refresh = monotonic()
+                return True
+            # Read before the refresh, so a change committed in between only causes one more refresh later.
+            source_version = await fetch_value(cursor, SOURCE_VERSION_SQL)
+            if seen_at is None and source_version == await fetch_value(cursor, FETCH_SOURCE_VERSION_SQL):
+                last_refresh = monotonic()
+                return True
+            await cursor.execute(REFRESH_SQL)
+            await cursor.execute(RECORD_REFRESH_SQL, (source_version,))
+    last_refresh = monotonic()
+    return True
+
+
+def requeue_change(seen_at: Optional[float]):
+    """Keep a change whose refresh did not happen pending, as seen at the earliest of the two moments."""
+    global changed_at
+    if seen_at is not None:
+        changed_at = seen_at if changed_at is None else min(changed_at, seen_at)
+
+
+async def refresh_now() -> dict:
+    """Bring the read model up to date with everything committed so far, waiting for a refresh running elsewhere."""
+    global changed_at
+    seen_at, changed_at = monotonic(), None
+    started = perf_counter()
+    try:
+        await refresh(wait=True, seen_at=seen_at)
+    except Exception:
+        requeue_change(seen_at)
+        raise
+    return {"refreshed_at": await fetch_refreshed_at(), "seconds": round(perf_counter() - started, 3)}
+
+
+async def fetch_refreshed_at() -> Optional[str]:
+    """Return when the read model was last refreshed."""
+    rows = await execute_query(FETCH_REFRESHED_AT_SQL)
+    return rows[0][0].isoformat(" ", "seconds") if rows else None
+
+
+async def refresh_loop():
+    """Refresh the read model shortly after catalog changes, and at least every READ_MODEL_MAX_AGE_SECONDS.
+
+    Together with the refresh time, READ_MODEL_REFRESH_SECONDS bounds how stale the listings can be; the periodic
+    check covers changes whose notification was lost while the change listener was reconnecting, and refreshes only
+    if the source tables changed.
+    """
+    global changed_at
+    while True:
+        await asyncio.sleep(READ_MODEL_REFRESH_SECONDS)
+        if changed_at is None and monotonic() - last_refresh < READ_MODEL_MAX_AGE_SECONDS:
+            continue
+        # Cleared before refreshing, so that changes notified during the refresh trigger another one.
+        seen_at, changed_at = changed_at, None
+        try:
+            if not await refresh(wait=False, seen_at=seen_at):
+                requeue_change(seen_at)
+        except asyncio.CancelledError:
+            requeue_change(seen_at)
+            raise
+        except Exception as e:
+            logger.warning("Could not refresh the product listing read model: %s", e)
+            requeue_change(seen_at)
+
+
+def start():
+    """Start refreshing the read model in the background."""
+    global refresh_task
+    refresh_task = asyncio.create_task(refresh_loop())
+
+
+async def stop():
+    """Stop the background refresh."""
+    global refresh_task
+    if refresh_task is not None:
+        refresh_task.cancel()
+        try:
+            await refresh_task
+        except asyncio.CancelledError:
+            pass
+        refresh_task = None
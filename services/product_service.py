@@ -1,28 +1,24 @@
 from datetime import datetime
-from typing import List
+from decimal import Decimal
+from typing import AsyncIterator, List, Optional, Union
+
+import orjson
 from fastapi import HTTPException
-from database import get_connection
-from models import ProductInDB, ProductUpdate, ProductSubcategoryCategory, ProductCreate
+from psycopg import sql
+from psycopg.errors import ForeignKeyViolation
+from database import execute_query, execute_shared_query, get_connection
+from services import subcategory_service
+from models import ProductInDB, ProductUpdate, ProductSubcategoryCategory, ProductCreate, ProductPage, \
+    ProductSearchResult, ProductQueryPage
+from utils.cursor import encode_cursor, decode_cursor
+from utils.loader import get_loader
+from utils.singleflight import SingleFlight
 
+PRODUCT_COLUMNS = "product_id, name, description, company, price, units, subcategory_id, created_at, updated_at"
+STREAM_BATCH_SIZE = 1000
+MAX_IDS_PER_LOOKUP = 1000
 
-def execute_query(query: str, params: tuple = None):
-    """Execute a query and return the results."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            if cursor.description:
-                results = cursor.fetchall()
-            else:
-                results = cursor.rowcount
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn is not None and not conn.closed:
-            conn.close()
-    return results
+read_queries = SingleFlight("products")
 
 
 def create_product_from_data(data: tuple) -> ProductInDB:
@@ -35,113 +31,416 @@ def create_product_from_data(data: tuple) -> ProductInDB:
         price=data[4],
         units=data[5],
         subcategory_id=data[6],
-        created_at=data[7].strftime("%Y-%m-%d %H:%M:%S"),
-        updated_at=data[8].strftime("%Y-%m-%d %H:%M:%S")
+        created_at=format_timestamp(data[7]),
+        updated_at=format_timestamp(data[8])
     )
 
 
-def fetch_products() -> List[ProductInDB]:
-    """Fetch all products from the database."""
-    query = "SELECT * FROM public.product"
-    data = execute_query(query)
+def format_timestamp(value: datetime) -> str:
+    """Format a timestamp as ISO 8601 with a space separator and second precision (2024-03-01 12:30:00)."""
+    return value.replace(tzinfo=None).isoformat(" ", "seconds")
+
+
+def product_dict_from_data(data: tuple) -> dict:
+    """Build the JSON representation of a ProductInDB straight from a row, with the same fields in the same order."""
+    return {
+        "created_at": format_timestamp(data[7]),
+        "updated_at": format_timestamp(data[8]),
+        "name": data[1],
+        "description": data[2],
+        "company": data[3],
+        "price": float(data[4]),
+        "units": data[5],
+        "subcategory_id": data[6],
+        "product_id": data[0]
+    }
+
+
+def product_with_subcategory_dict_from_data(data: tuple) -> dict:
+    """Build the JSON representation of a ProductSubcategoryCategory straight from a row."""
+    return {
+        "category_name": data[0],
+        "subcategory_name": data[1],
+        "product_name": data[2],
+        "product_brand": data[3],
+        "price": float(data[4])
+    }
+
+
+async def fetch_products(encoded: bool = False) -> Union[List[ProductInDB], bytes]:
+    """Fetch all products from the database.
+
+    With `encoded`, the rows are encoded straight to JSON bytes without building a model per row.
+    """
+    query = f"SELECT {PRODUCT_COLUMNS} FROM public.product"
+    data = await execute_shared_query(read_queries, query)
+    if encoded:
+        return orjson.dumps([product_dict_from_data(product_data) for product_data in data])
     return [create_product_from_data(product_data) for product_data in data]
 
 
-def fetch_product(id: int) -> ProductInDB:
-    """Fetch a product by its ID."""
-    query = "SELECT * FROM public.product WHERE product_id = %s"
-    data = execute_query(query, (id,))
-    return create_product_from_data(data[0]) if data else None
+async def fetch_products_version():
+    """Return the latest updated_at and the row count of the product table."""
+    query = "SELECT max(updated_at), count(*) FROM public.product"
+    return (await execute_shared_query(read_queries, query))[0]
+
+
+async def fetch_product_version(id: int):
+    """Return the updated_at of a product, or None if it does not exist."""
+    query = "SELECT updated_at FROM public.product WHERE product_id = %s"
+    data = await execute_shared_query(read_queries, query, (id,))
+    return data[0][0] if data else None
+
+
+async def fetch_products_version_by_ids(ids: List[int]):
+    """Return the latest updated_at and the number of the products with the given IDs."""
+    query = "SELECT max(updated_at), count(*) FROM public.product WHERE product_id = ANY(%s)"
+    return (await execute_shared_query(read_queries, query, (list(ids),)))[0]
+
+
+async def fetch_catalog_version():
+    """Return the latest updated_at and the row count of the product, subcategory and category tables.
+
+    The joined listings change whenever any of the three tables does.
+    """
+    query = """
+    SELECT product.updated_at, product.count, subcategory.updated_at, subcategory.count,
+           category.updated_at, category.count
+    FROM (SELECT max(updated_at) AS updated_at, count(*) FROM public.product) AS product,
+         (SELECT max(updated_at) AS updated_at, count(*) FROM public.subcategory) AS subcategory,
+         (SELECT max(updated_at) AS updated_at, count(*) FROM public.category) AS category
+    """
+    return (await execute_shared_query(read_queries, query))[0]
+
+
+async def fetch_listing_version():
+    """Return when the product listing read model was last refreshed; the listings served from it change only then."""
+    query = "SELECT refreshed_at FROM public.read_model_refresh WHERE name = 'product_listing'"
+    rows = await execute_shared_query(read_queries, query)
+    return rows[0][0] if rows else None
+
+
+async def stream_products(batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[List[ProductInDB]]:
+    """Fetch all products in batches through a server-side cursor.
+
+    Only one batch is held in memory at a time; the pooled connection is kept until the iteration ends.
+    """
+    query = f"SELECT {PRODUCT_COLUMNS} FROM public.product"
+    async with get_connection() as conn:
+        async with conn.cursor(name="stream_products") as cursor:
+            await cursor.execute(query)
+            while data := await cursor.fetchmany(batch_size):
+                yield [create_product_from_data(product_data) for product_data in data]
+
+
+async def fetch_product_rows(ids: list) -> dict:
+    """Fetch the rows of several products with a single query, keyed by their ID."""
+    query = f"SELECT {PRODUCT_COLUMNS} FROM public.product WHERE product_id = ANY(%s)"
+    data = await execute_shared_query(read_queries, query, (ids,))
+    return {product_data[0]: product_data for product_data in data}
+
+
+async def fetch_product(id: int) -> ProductInDB:
+    """Fetch a product by its ID.
+
+    Lookups made during the same request are batched into one query by the request-scoped loader.
+    """
+    data = await get_loader("products", fetch_product_rows).load(id)
+    return create_product_from_data(data) if data else None
 
 
-def create_product(product: ProductCreate):
+async def fetch_products_by_ids(ids: List[int], encoded: bool = False) -> Union[List[ProductInDB], bytes]:
+    """Fetch several products by their IDs with a single query, in the order requested.
+
+    Duplicated IDs are returned once and missing IDs are skipped. With `encoded`, the rows are encoded straight to
+    JSON bytes.
+    """
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_IDS_PER_LOOKUP:
+        raise ValueError(f"Cannot fetch more than {MAX_IDS_PER_LOOKUP} products at once.")
+    rows = await fetch_product_rows(ids)
+    if encoded:
+        return orjson.dumps([product_dict_from_data(rows[id]) for id in ids if id in rows])
+    return [create_product_from_data(rows[id]) for id in ids if id in rows]
+
+
+async def create_product(product: ProductCreate):
     """Create a new product in the database."""
-    if not subcategory_exists(product.subcategory_id):
+    if not await subcategory_exists(product.subcategory_id):
         raise Exception("Subcategory not found")
     query = "INSERT INTO public.product (name, description, company, price, units, subcategory_id, created_at, updated_at) VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())"
-    execute_query(query, (product.name, product.description, product.company, product.price, product.units,
+    await execute_query(query, (product.name, product.description, product.company, product.price, product.units,
                           product.subcategory_id))
+    read_queries.forget()
 
 
-def product_exists(id: int) -> bool:
+async def product_exists(id: int) -> bool:
     """Check if a product exists in the database."""
-    query = "SELECT * FROM public.product WHERE product_id = %s"
-    data = execute_query(query, (id,))
+    query = "SELECT 1 FROM public.product WHERE product_id = %s"
+    data = await execute_query(query, (id,))
     return bool(data)
 
 
-def subcategory_exists(id: int) -> bool:
+async def subcategory_exists(id: int) -> bool:
     """Check if a subcategory exists in the database."""
-    query = "SELECT * FROM public.subcategory WHERE subcategory_id = %s"
-    data = execute_query(query, (id,))
-    return bool(data)
+    return await subcategory_service.subcategory_exists(id)
 
 
-def update_product(id: int, product: ProductUpdate):
-    """Update an existing product in the database."""
-    try:
-        if not product_exists(id) or not subcategory_exists(product.subcategory_id):
-            raise Exception("Product or subcategory not found")
+async def update_product(id: int, product: ProductUpdate):
+    """Update an existing product in the database.
 
-        query = "UPDATE public.product SET name = %s, description = %s, company = %s, price = %s, units = %s, subcategory_id = %s, updated_at = NOW() WHERE product_id = %s"
-        rows_affected = execute_query(query, (
-            product.name, product.description, product.company, product.price, product.units, product.subcategory_id,
-            id))
+    A missing product or subcategory is detected from the statement itself (no row returned or a foreign key
+    violation), so the update costs a single round trip.
+    """
+    try:
+        query = "UPDATE public.product SET name = %s, description = %s, company = %s, price = %s, units = %s, subcategory_id = %s, updated_at = NOW() WHERE product_id = %s RETURNING product_id"
+        try:
+            updated = await execute_query(query, (
+                product.name, product.description, product.company, product.price, product.units,
+                product.subcategory_id, id))
+        except ForeignKeyViolation:
+            updated = None
+        read_queries.forget()
 
-        if rows_affected == 0:
-            raise Exception("Update operation failed")
+        if not updated:
+            raise Exception("Product or subcategory not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def delete_product(id: int):
+async def delete_product(id: int):
     """Delete a product from the database."""
-    if not product_exists(id):
+    query = "DELETE FROM public.product WHERE product_id = %s RETURNING product_id"
+    deleted = await execute_query(query, (id,))
+    read_queries.forget()
+    if not deleted:
         raise Exception("Product not found")
-    query = "DELETE FROM public.product WHERE product_id = %s"
-    execute_query(query, (id,))
 
 
-def fetch_products_orderby(orderby):
-    """Fetch all products from the database ordered by name."""
+async def fetch_products_orderby(orderby, encoded: bool = False):
+    """Fetch all products from the database ordered by name; with `encoded`, as JSON bytes."""
     if orderby not in ["asc", "desc"]:
         raise ValueError("Invalid value for ordering. Expected 'asc' or 'desc'.")
 
     query = f"""
-    SELECT category.name, subcategory.name, product.name, product.company, product.price
-    FROM public.product
-    INNER JOIN public.subcategory ON product.subcategory_id = subcategory.subcategory_id
-    INNER JOIN public.category ON subcategory.category_id = category.category_id
-    ORDER BY product.name {orderby}
+    SELECT category_name, subcategory_name, product_name, product_brand, price
+    FROM public.product_listing
+    ORDER BY product_name {orderby}
     """
-    data = execute_query(query)
+    data = await execute_shared_query(read_queries, query)
+    if encoded:
+        return orjson.dumps([product_with_subcategory_dict_from_data(product_data) for product_data in data])
     return [create_product_with_subcategory_from_data(product_data) for product_data in data]
 
 
-def fetch_products_contain(name):
-    """Fetch all products from the database that contain a given name."""
+async def fetch_products_contain(name, encoded: bool = False):
+    """Fetch all products from the database that contain a given name; with `encoded`, as JSON bytes."""
     query = f"""
-    SELECT category.name, subcategory.name, product.name, product.company, product.price
+    SELECT category_name, subcategory_name, product_name, product_brand, price
+    FROM public.product_listing
+    WHERE product_name LIKE %s
+    """
+    data = await execute_shared_query(read_queries, query, (f"%{name}%",))
+    if encoded:
+        return orjson.dumps([product_with_subcategory_dict_from_data(product_data) for product_data in data])
+    return [create_product_with_subcategory_from_data(product_data) for product_data in data]
+
+
+async def fetch_products_skip_limit(skip, limit, encoded: bool = False):
+    """Fetch a limited number of products from the database with an offset; with `encoded`, as JSON bytes."""
+    query = f"""
+    SELECT category_name, subcategory_name, product_name, product_brand, price
+    FROM public.product_listing
+    ORDER BY product_id
+    Limit %s Offset %s
+    """
+    data = await execute_shared_query(read_queries, query, (limit, skip))
+    if encoded:
+        return orjson.dumps([product_with_subcategory_dict_from_data(product_data) for product_data in data])
+    return [create_product_with_subcategory_from_data(product_data) for product_data in data]
+
+
+PRODUCTS_PAGE_SQL = """
+    SELECT category.name, subcategory.name, product.name, product.company, product.price, product.product_id
     FROM public.product
     INNER JOIN public.subcategory ON product.subcategory_id = subcategory.subcategory_id
     INNER JOIN public.category ON subcategory.category_id = category.category_id
-    WHERE product.name LIKE %s
+    {where}
+    ORDER BY {order}
+    LIMIT %s
+"""
+PRODUCTS_PAGE_KEYSETS = {
+    "id": ("product.product_id", "product.product_id > %s"),
+    "name": ("product.name, product.product_id", "(product.name, product.product_id) > (%s, %s)"),
+}
+
+
+async def fetch_products_page(limit: int, cursor: str = None, order: str = "id") -> ProductPage:
+    """Fetch a page of products using keyset pagination.
+
+    Rows are ordered by product_id or by (name, product_id) and the page starts right after the key encoded
+    in the cursor, so every page costs the same regardless of how deep it is.
     """
-    data = execute_query(query, (f"%{name}%",))
-    return [create_product_with_subcategory_from_data(product_data) for product_data in data]
+    if order not in PRODUCTS_PAGE_KEYSETS:
+        raise ValueError("Invalid value for ordering. Expected 'id' or 'name'.")
 
+    order_by, keyset_condition = PRODUCTS_PAGE_KEYSETS[order]
+    if cursor:
+        key = decode_cursor(cursor, order)
+        if not isinstance(key, list) or len(key) != keyset_condition.count("%s"):
+            raise ValueError("Invalid cursor.")
+        query = PRODUCTS_PAGE_SQL.format(where=f"WHERE {keyset_condition}", order=order_by)
+        params = (*key, limit + 1)
+    else:
+        query = PRODUCTS_PAGE_SQL.format(where="", order=order_by)
+        params = (limit + 1,)
 
-def fetch_products_skip_limit(skip, limit):
-    """Fetch a limited number of products from the database with an offset."""
-    query = f"""
-    SELECT category.name, subcategory.name, product.name, product.company, product.price
+    data = await execute_shared_query(read_queries, query, params)
+    next_cursor = None
+    if len(data) > limit:
+        data = data[:limit]
+        last = data[-1]
+        next_cursor = encode_cursor(order, [last[5]] if order == "id" else [last[2], last[5]])
+    return ProductPage(
+        items=[create_product_with_subcategory_from_data(product_data) for product_data in data],
+        next_cursor=next_cursor
+    )
+
+
+QUERY_PRODUCTS_SQL = sql.SQL("""
+    SELECT {columns}
+    FROM public.product
+    {where}
+    ORDER BY {sort} {direction}, product.product_id {direction}
+    LIMIT %s
+""")
+# Only these columns can be sorted on; each has an index starting with it (see sql/010_product_query_indexes.sql).
+QUERY_PRODUCTS_SORTS = {
+    "name": sql.Identifier("product", "name"),
+    "price": sql.Identifier("product", "price"),
+    "updated_at": sql.Identifier("product", "updated_at"),
+}
+QUERY_PRODUCTS_DIRECTIONS = {"asc": (sql.SQL("ASC"), sql.SQL(">")), "desc": (sql.SQL("DESC"), sql.SQL("<"))}
+QUERY_PRODUCTS_COLUMNS = sql.SQL(", ").join(sql.Identifier("product", column) for column in PRODUCT_COLUMNS.split(", "))
+
+
+def cursor_value(value):
+    """Make a sort key JSON serializable without losing precision; the database casts it back when comparing."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+async def query_products(limit: int, cursor: str = None, sort: str = "name", direction: str = "asc",
+                         category_id: Optional[int] = None, subcategory_id: Optional[int] = None,
+                         company: Optional[str] = None, price_min: Optional[Decimal] = None,
+                         price_max: Optional[Decimal] = None, in_stock: Optional[bool] = None) -> ProductQueryPage:
+    """Fetch a page of the products matching every given filter, sorted by a whitelisted column.
+
+    The statement is composed from fixed fragments and only the values are sent as parameters. Pages are keyset
+    paginated on (sort column, product_id), like /products/cursor/.
+    """
+    if sort not in QUERY_PRODUCTS_SORTS:
+        raise ValueError(f"Invalid sort key. Expected one of: {', '.join(QUERY_PRODUCTS_SORTS)}.")
+    if direction not in QUERY_PRODUCTS_DIRECTIONS:
+        raise ValueError("Invalid value for direction. Expected 'asc' or 'desc'.")
+    if price_min is not None and price_max is not None and price_min > price_max:
+        raise ValueError("price_min cannot be greater than price_max.")
+
+    conditions, params = [], []
+    if category_id is not None:
+        conditions.append(sql.SQL(
+            "product.subcategory_id IN (SELECT subcategory_id FROM public.subcategory WHERE category_id = %s)"
+        ))
+        params.append(category_id)
+    if subcategory_id is not None:
+        conditions.append(sql.SQL("product.subcategory_id = %s"))
+        params.append(subcategory_id)
+    if company is not None:
+        conditions.append(sql.SQL("product.company = %s"))
+        params.append(company)
+    if price_min is not None:
+        conditions.append(sql.SQL("product.price >= %s"))
+        params.append(price_min)
+    if price_max is not None:
+        conditions.append(sql.SQL("product.price <= %s"))
+        params.append(price_max)
+    if in_stock is not None:
+        conditions.append(sql.SQL("product.units > 0" if in_stock else "product.units <= 0"))
+
+    sort_column = QUERY_PRODUCTS_SORTS[sort]
+    order, comparison = QUERY_PRODUCTS_DIRECTIONS[direction]
+    cursor_order = f"{sort}:{direction}"
+    if cursor:
+        key = decode_cursor(cursor, cursor_order)
+        if not isinstance(key, list) or len(key) != 2:
+            raise ValueError("Invalid cursor.")
+        conditions.append(sql.SQL("({}, product.product_id) {} (%s, %s)").format(sort_column, comparison))
+        params.extend(key)
+
+    where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+    query = QUERY_PRODUCTS_SQL.format(columns=QUERY_PRODUCTS_COLUMNS, where=where, sort=sort_column, direction=order)
+    data = await execute_shared_query(read_queries, query, (*params, limit + 1))
+
+    next_cursor = None
+    if len(data) > limit:
+        data = data[:limit]
+        last = data[-1]
+        sort_index = PRODUCT_COLUMNS.split(", ").index(sort)
+        next_cursor = encode_cursor(cursor_order, [cursor_value(last[sort_index]), last[0]])
+    return ProductQueryPage(items=[create_product_from_data(product_data) for product_data in data],
+                            next_cursor=next_cursor)
+
+
+SEARCH_PRODUCTS_SQL = """
+    SELECT category.name, subcategory.name, product.name, product.company, product.price, product.product_id,
+           ts_rank(product.search_vector, search.query)
+               + similarity(public.immutable_unaccent(lower(product.name)), search.term) AS rank
     FROM public.product
     INNER JOIN public.subcategory ON product.subcategory_id = subcategory.subcategory_id
     INNER JOIN public.category ON subcategory.category_id = category.category_id
-    Limit %s Offset %s
+    CROSS JOIN (
+        SELECT websearch_to_tsquery('simple', public.immutable_unaccent(%(text)s)) AS query,
+               public.immutable_unaccent(lower(%(text)s)) AS term
+    ) AS search
+    WHERE product.search_vector @@ search.query
+       OR public.immutable_unaccent(lower(product.name)) LIKE public.immutable_unaccent(lower(%(pattern)s))
+    ORDER BY rank DESC, product.product_id
+    LIMIT %(limit)s OFFSET %(offset)s
+"""
+
+
+def escape_like(value: str) -> str:
+    """Escape the LIKE wildcards of a user supplied string."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search_products(text: str, limit: int, offset: int = 0) -> List[ProductSearchResult]:
+    """Search products by name, description and company.
+
+    Matches are case and accent insensitive: full-text matches over the weighted search vector and substring
+    matches on the name, both served by indexes. Results are ordered by relevance.
     """
-    data = execute_query(query, (limit, skip))
-    return [create_product_with_subcategory_from_data(product_data) for product_data in data]
+    text = text.strip()
+    if not text:
+        raise ValueError("The search text cannot be empty.")
+
+    params = {"text": text, "pattern": f"%{escape_like(text)}%", "limit": limit, "offset": offset}
+    data = await execute_shared_query(read_queries, SEARCH_PRODUCTS_SQL, params)
+    return [
+        ProductSearchResult(
+            category_name=product_data[0],
+            subcategory_name=product_data[1],
+            product_name=product_data[2],
+            product_brand=product_data[3],
+            price=product_data[4],
+            product_id=product_data[5],
+            rank=product_data[6]
+        )
+        for product_data in data
+    ]
 
 
 def create_product_with_subcategory_from_data(data: tuple) -> ProductSubcategoryCategory:
@@ -0,0 +1,79 @@
+from typing import List, Optional
+
+from database import execute_shared_query
+from models import CategoryStats, SubcategoryStats
+from services import change_listener
+from utils.singleflight import SingleFlight
+
+# The per-subcategory rollup is maintained by triggers on the product table (sql/009_catalog_stats_rollups.sql), so
+# these queries only read a handful of rows however large the catalog is.
+STATS_COLUMNS = """
+    sum(stats.product_count), sum(stats.total_units), min(stats.min_price),
+    sum(stats.price_sum) / sum(stats.product_count), max(stats.max_price), sum(stats.stock_value)
+"""
+FETCH_CATEGORY_STATS_SQL = f"""
+    SELECT category.category_id, category.name, {STATS_COLUMNS}
+    FROM public.subcategory_stats AS stats
+    INNER JOIN public.subcategory ON stats.subcategory_id = subcategory.subcategory_id
+    INNER JOIN public.category ON subcategory.category_id = category.category_id
+    GROUP BY category.category_id, category.name
+    ORDER BY category.category_id
+"""
+FETCH_SUBCATEGORY_STATS_SQL = f"""
+    SELECT category.category_id, category.name, subcategory.subcategory_id, subcategory.name, {STATS_COLUMNS}
+    FROM public.subcategory_stats AS stats
+    INNER JOIN public.subcategory ON stats.subcategory_id = subcategory.subcategory_id
+    INNER JOIN public.category ON subcategory.category_id = category.category_id
+    GROUP BY category.category_id, category.name, subcategory.subcategory_id, subcategory.name
+    ORDER BY category.category_id, subcategory.subcategory_id
+"""
+# The figures change with the rollup, the names and the category of a subcategory with the two small tables.
+FETCH_STATS_VERSION_SQL = """
+    SELECT stats.updated_at, stats.count, subcategory.updated_at, subcategory.count,
+           category.updated_at, category.count
+    FROM (SELECT max(updated_at) AS updated_at, count(*) FROM public.subcategory_stats) AS stats,
+         (SELECT max(updated_at) AS updated_at, count(*) FROM public.subcategory) AS subcategory,
+         (SELECT max(updated_at) AS updated_at, count(*) FROM public.category) AS category
+"""
+
+read_queries = SingleFlight("stats")
+
+
+def apply_catalog_change(changed_id: Optional[int], operation: str):
+    """Stop sharing stats queries started before a catalog change made by any worker."""
+    read_queries.forget()
+
+
+for table in ("product", "subcategory", "category"):
+    change_listener.subscribe(table, apply_catalog_change)
+
+
+def stats_dict_from_data(data: tuple) -> dict:
+    """Build the figures of a stats row, which always come last in the row."""
+    product_count, total_units, min_price, avg_price, max_price, stock_value = data[-6:]
+    return {
+        "product_count": product_count,
+        "total_units": total_units,
+        "min_price": float(min_price),
+        "avg_price": round(float(avg_price), 2),
+        "max_price": float(max_price),
+        "stock_value": float(stock_value)
+    }
+
+
+async def fetch_stats_version():
+    """Return the latest change of the rollup and of the subcategory and category tables."""
+    return (await execute_shared_query(read_queries, FETCH_STATS_VERSION_SQL))[0]
+
+
+async def fetch_category_stats() -> List[CategoryStats]:
+    """Fetch the product count, units, prices and stock value of every category with products."""
+    data = await execute_shared_query(read_queries, FETCH_CATEGORY_STATS_SQL)
+    return [CategoryStats(category_id=row[0], category_name=row[1], **stats_dict_from_data(row)) for row in data]
+
+
+async def fetch_subcategory_stats() -> List[SubcategoryStats]:
+    """Fetch the product count, units, prices and stock value of every subcategory with products."""
+    data = await execute_shared_query(read_queries, FETCH_SUBCATEGORY_STATS_SQL)
+    return [SubcategoryStats(category_id=row[0], category_name=row[1], subcategory_id=row[2],
+                             subcategory_name=row[3], **stats_dict_from_data(row)) for row in data]
@@ -4,53 +4,58 @@ from fastapi import HTTPException
 from psycopg import Error
 
 from utils.apiResponse import ApiResponse
-from database import get_connection
+from database import execute_query, execute_shared_query
 from models import Subcategory
+from services import change_listener
+from utils.cache import TTLCache
+from utils.loader import get_loader
+from utils.singleflight import SingleFlight
 
+ALL_SUBCATEGORIES = "all"
+subcategory_cache = TTLCache("subcategories")
+read_queries = SingleFlight("subcategories")
 
-def execute_query(query: str, params: tuple = None):
-    """Execute a query and return the results."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
-            if cursor.description:
-                results = cursor.fetchall()
-            else:
-                results = cursor.rowcount
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        if conn is not None and not conn.closed:
-            conn.close()
-    return results
-
-
-def fetch_subcategories():
+
+async def fetch_subcategories():
     """Fetch all subcategories from the database."""
-    return execute_query("SELECT * FROM public.subcategory")
+    query = "SELECT * FROM public.subcategory"
+    return await subcategory_cache.get_or_load(ALL_SUBCATEGORIES,
+                                                lambda: execute_shared_query(read_queries, query))
+
+
+async def fetch_subcategories_by_ids(subcategory_ids: list) -> dict:
+    """Fetch several subcategories with a single query, keyed by their ID."""
+    query = "SELECT subcategory_id, * FROM public.subcategory WHERE subcategory_id = ANY(%s)"
+    data = await execute_shared_query(read_queries, query, (subcategory_ids,))
+    return {row[0]: row[1:] for row in data}
+
+
+async def load_subcategory(subcategory_id: int) -> list:
+    """Load a subcategory through the request-scoped loader, batching the lookups made during the request."""
+    row = await get_loader("subcategories", fetch_subcategories_by_ids).load(subcategory_id)
+    return [row] if row is not None else []
 
 
-def fetch_subcategory(subcategory_id: int):
+async def fetch_subcategory(subcategory_id: int):
     """Fetch a subcategory by its ID."""
-    query = "SELECT * FROM public.subcategory WHERE subcategory_id = %s"
-    return execute_query(query, (subcategory_id,))
+    return await subcategory_cache.get_or_load(subcategory_id, lambda: load_subcategory(subcategory_id))
 
 
-def execute_insert_query(query: str, params: tuple) -> int:
+async def execute_insert_query(query: str, params: tuple) -> int:
     """Execute an insert query and return the number of affected rows."""
     try:
-        return execute_query(query, params)
+        return await execute_query(query, params)
     except Error as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-def create_subcategory(subcategory: Subcategory):
+async def create_subcategory(subcategory: Subcategory):
     """Create a new subcategory in the database."""
     query = "INSERT INTO public.subcategory (name, category_id,created_at,updated_at) VALUES (%s, %s, NOW(), NOW())"
-    rows_affected = execute_insert_query(query, (subcategory.name, subcategory.category_id))
+    rows_affected = await execute_insert_query(query, (subcategory.name, subcategory.category_id))
+    # The new id is generated by the database and may have been cached as missing.
+    subcategory_cache.clear()
+    read_queries.forget()
     if rows_affected == 0:
         response = ApiResponse("failed", "No changes were made", True)
     else:
@@ -59,18 +64,20 @@ def create_subcategory(subcategory: Subcategory):
     return response.convert_to_dict()
 
 
-def execute_update_query(query: str, params: tuple) -> int:
+async def execute_update_query(query: str, params: tuple) -> int:
     """Execute an update query and return the number of affected rows."""
     try:
-        return execute_query(query, params)
+        return await execute_query(query, params)
     except Error as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-def update_subcategory(subcategory_id: int, subcategory: Subcategory):
+async def update_subcategory(subcategory_id: int, subcategory: Subcategory):
     """Update an existing subcategory in the database."""
     query = "UPDATE public.subcategory SET name = %s,updated_at = NOW() WHERE subcategory_id = %s"
-    rows_affected = execute_update_query(query, (subcategory.name, subcategory_id))
+    rows_affected = await execute_update_query(query, (subcategory.name, subcategory_id))
+    subcategory_cache.invalidate(subcategory_id, ALL_SUBCATEGORIES)
+    read_queries.forget()
     if rows_affected == 0:
         response = ApiResponse("failed", "No changes were made", True)
     else:
@@ -78,29 +85,39 @@ def update_subcategory(subcategory_id: int, subcategory: Subcategory):
     return response.convert_to_dict()
 
 
-def delete_subcategory(subcategory_id: int) -> Dict[str, str]:
+async def delete_subcategory(subcategory_id: int) -> Dict[str, str]:
     """Delete a subcategory from the database."""
-    if not subcategory_exists(subcategory_id):
+    query = "DELETE FROM public.subcategory WHERE subcategory_id = %s RETURNING subcategory_id"
+    deleted = await execute_delete_query(query, (subcategory_id,))
+    if not deleted:
         response = ApiResponse("failed", "Subcategory not found", True)
     else:
-        query = "DELETE FROM public.subcategory WHERE subcategory_id = %s"
-        rows_affected = execute_delete_query(query, (subcategory_id,))
-        if rows_affected == 0:
-            response = ApiResponse("failed", "No changes were made", True)
-        else:
-            response = ApiResponse("success", "Subcategory deleted successfully", False)
+        subcategory_cache.invalidate(subcategory_id, ALL_SUBCATEGORIES)
+        read_queries.forget()
+        response = ApiResponse("success", "Subcategory deleted successfully", False)
     return response.convert_to_dict()
 
 
-def execute_delete_query(query: str, params: tuple) -> int:
-    """Execute a delete query and return the number of affected rows."""
+async def execute_delete_query(query: str, params: tuple):
+    """Execute a delete query and return its results."""
     try:
-        return execute_query(query, params)
+        return await execute_query(query, params)
     except Error as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-def subcategory_exists(subcategory_id: int):
+async def subcategory_exists(subcategory_id: int):
     """Check if a subcategory exists in the database."""
-    query = "SELECT * FROM public.subcategory WHERE subcategory_id = %s"
-    return True if execute_query(query, (subcategory_id,)) else False
+    return True if await fetch_subcategory(subcategory_id) else False
+
+
+def apply_subcategory_change(subcategory_id: int, operation: str):
+    """Invalidate the cached entries of a subcategory changed by any worker."""
+    if subcategory_id is None:
+        subcategory_cache.clear()
+    else:
+        subcategory_cache.invalidate(subcategory_id, ALL_SUBCATEGORIES)
+    read_queries.forget()
+
+
+change_listener.subscribe("subcategory", apply_subcategory_change)
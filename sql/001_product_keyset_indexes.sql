@@ -0,0 +1,3 @@
+-- Indexes backing the keyset pagination of GET /products/products/cursor/.
+-- product_id is already covered by the primary key.
+CREATE INDEX IF NOT EXISTS product_name_product_id_idx ON public.product (name, product_id);
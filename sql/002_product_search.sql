@@ -0,0 +1,19 @@
+-- Indexed substring and full-text search used by GET /products/products/search/.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() is only STABLE, so it cannot be used in indexes or generated columns directly.
+CREATE OR REPLACE FUNCTION public.immutable_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+
+ALTER TABLE public.product
+    ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', public.immutable_unaccent(coalesce(name, ''))), 'A') ||
+        setweight(to_tsvector('simple', public.immutable_unaccent(coalesce(company, ''))), 'B') ||
+        setweight(to_tsvector('simple', public.immutable_unaccent(coalesce(description, ''))), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS product_search_vector_idx ON public.product USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS product_name_trgm_idx
+    ON public.product USING gin (public.immutable_unaccent(lower(name)) gin_trgm_ops);
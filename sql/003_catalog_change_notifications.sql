@@ -0,0 +1,62 @@
+-- Publish catalog changes on the catalog_changes channel so every worker can invalidate its in-process caches.
+-- Payload: {"table": "...", "id": "...", "operation": "INSERT" | "UPDATE" | "DELETE"}.
+-- Statement-level triggers are used so that bulk writes (CSV imports) touching more than 100 rows send a single
+-- notification with a null id, meaning "anything in this table may have changed".
+CREATE OR REPLACE FUNCTION public.notify_catalog_change() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+DECLARE
+    id_column text := TG_ARGV[0];
+    changed_ids text[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        EXECUTE format('SELECT array_agg(%1$I::text) FROM (SELECT %1$I FROM old_rows LIMIT 101) AS changed', id_column)
+            INTO changed_ids;
+    ELSE
+        EXECUTE format('SELECT array_agg(%1$I::text) FROM (SELECT %1$I FROM new_rows LIMIT 101) AS changed', id_column)
+            INTO changed_ids;
+    END IF;
+
+    IF changed_ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    IF cardinality(changed_ids) > 100 THEN
+        PERFORM pg_notify('catalog_changes',
+                          json_build_object('table', TG_TABLE_NAME, 'id', NULL, 'operation', TG_OP)::text);
+    ELSE
+        PERFORM pg_notify('catalog_changes',
+                          json_build_object('table', TG_TABLE_NAME, 'id', changed_id, 'operation', TG_OP)::text)
+        FROM unnest(changed_ids) AS changed_id;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DO $$
+DECLARE
+    catalog_table record;
+BEGIN
+    FOR catalog_table IN
+        SELECT * FROM (VALUES ('category', 'category_id'),
+                              ('subcategory', 'subcategory_id'),
+                              ('product', 'product_id')) AS t (table_name, id_column)
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notify_insert ON public.%1$I', catalog_table.table_name);
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notify_update ON public.%1$I', catalog_table.table_name);
+        EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notify_delete ON public.%1$I', catalog_table.table_name);
+        EXECUTE format('CREATE TRIGGER %1$s_notify_insert AFTER INSERT ON public.%1$I '
+                       'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT '
+                       'EXECUTE FUNCTION public.notify_catalog_change(%2$L)',
+                       catalog_table.table_name, catalog_table.id_column);
+        EXECUTE format('CREATE TRIGGER %1$s_notify_update AFTER UPDATE ON public.%1$I '
+                       'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT '
+                       'EXECUTE FUNCTION public.notify_catalog_change(%2$L)',
+                       catalog_table.table_name, catalog_table.id_column);
+        EXECUTE format('CREATE TRIGGER %1$s_notify_delete AFTER DELETE ON public.%1$I '
+                       'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT '
+                       'EXECUTE FUNCTION public.notify_catalog_change(%2$L)',
+                       catalog_table.table_name, catalog_table.id_column);
+    END LOOP;
+END;
+$$;
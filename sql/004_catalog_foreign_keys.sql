@@ -0,0 +1,22 @@
+-- The write paths rely on foreign key violations to report missing subcategories/categories in a single statement.
+-- Add the constraints when the schema does not have them yet. NOT VALID skips checking existing rows while still
+-- enforcing the constraint for every new write.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'public.product'::regclass AND contype = 'f'
+                     AND confrelid = 'public.subcategory'::regclass) THEN
+        ALTER TABLE public.product
+            ADD CONSTRAINT product_subcategory_id_fkey FOREIGN KEY (subcategory_id)
+                REFERENCES public.subcategory (subcategory_id) NOT VALID;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'public.subcategory'::regclass AND contype = 'f'
+                     AND confrelid = 'public.category'::regclass) THEN
+        ALTER TABLE public.subcategory
+            ADD CONSTRAINT subcategory_category_id_fkey FOREIGN KEY (category_id)
+                REFERENCES public.category (category_id) NOT VALID;
+    END IF;
+END;
+$$;
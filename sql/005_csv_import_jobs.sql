@@ -0,0 +1,18 @@
+-- Background CSV imports (POST /products/import/). Each job commits its rows in batches and records the last
+-- committed line together with them, so a failed job can be resumed where it stopped.
+CREATE TABLE IF NOT EXISTS public.csv_import_job (
+    job_id uuid PRIMARY KEY,
+    file_path text NOT NULL,
+    status text NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'completed', 'failed')),
+    last_line integer NOT NULL DEFAULT 0,
+    rows_processed integer NOT NULL DEFAULT 0,
+    rows_rejected integer NOT NULL DEFAULT 0,
+    active_seconds double precision NOT NULL DEFAULT 0,
+    counts jsonb NOT NULL DEFAULT '{}',
+    errors jsonb NOT NULL DEFAULT '[]',
+    error text,
+    created_at timestamp NOT NULL DEFAULT NOW(),
+    started_at timestamp,
+    updated_at timestamp NOT NULL DEFAULT NOW(),
+    finished_at timestamp
+);
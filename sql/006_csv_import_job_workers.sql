@@ -0,0 +1,2 @@
+-- Parallel CSV imports: number of worker processes loading the partitions of a job (1 = sequential, resumable).
+ALTER TABLE public.csv_import_job ADD COLUMN IF NOT EXISTS workers integer NOT NULL DEFAULT 1;
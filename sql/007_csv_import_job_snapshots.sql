@@ -0,0 +1,2 @@
+-- Snapshot CSV imports: delete the products that are not in the uploaded file once it has been imported.
+ALTER TABLE public.csv_import_job ADD COLUMN IF NOT EXISTS delete_missing boolean NOT NULL DEFAULT false;
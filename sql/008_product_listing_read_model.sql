@@ -0,0 +1,26 @@
+-- Denormalized read model behind GET /products/products/orderby/, /contain/ and /skip_limit/: every product with the
+-- names of its subcategory and category, so the listings do not join the three tables on every request. The
+-- application refreshes it concurrently after catalog changes (see READ_MODEL_REFRESH_SECONDS).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.product_listing AS
+SELECT product.product_id, category.name AS category_name, subcategory.name AS subcategory_name,
+       product.name AS product_name, product.company AS product_brand, product.price
+FROM public.product
+INNER JOIN public.subcategory ON product.subcategory_id = subcategory.subcategory_id
+INNER JOIN public.category ON subcategory.category_id = category.category_id;
+
+-- REFRESH ... CONCURRENTLY needs a unique index; it also serves the product_id ordering of /skip_limit/.
+CREATE UNIQUE INDEX IF NOT EXISTS product_listing_product_id_idx ON public.product_listing (product_id);
+CREATE INDEX IF NOT EXISTS product_listing_product_name_idx ON public.product_listing (product_name);
+CREATE INDEX IF NOT EXISTS product_listing_product_name_trgm_idx
+    ON public.product_listing USING gin (product_name gin_trgm_ops);
+
+CREATE TABLE IF NOT EXISTS public.read_model_refresh (
+    name text PRIMARY KEY,
+    refreshed_at timestamp NOT NULL
+);
+-- Version of the source tables the view was last refreshed from; the periodic check skips the refresh while it holds.
+ALTER TABLE public.read_model_refresh ADD COLUMN IF NOT EXISTS source_version text;
+INSERT INTO public.read_model_refresh (name, refreshed_at) VALUES ('product_listing', NOW())
+ON CONFLICT (name) DO NOTHING;
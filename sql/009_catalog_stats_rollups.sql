@@ -0,0 +1,107 @@
+-- Rollup behind GET /products/stats/: product count, units, prices and stock value of every subcategory, kept up to
+-- date by statement-level triggers on product, so every write path (product_service, the CSV loader, the import jobs,
+-- plain SQL and TRUNCATE) maintains it. The category figures are rolled up from it when read, which also keeps them
+-- right when a subcategory moves to another category.
+-- Only the subcategories touched by a statement are recomputed, and an index on (subcategory_id, price, units) lets
+-- the recompute read just their products. min/max cannot be maintained from deltas alone once rows are deleted, so
+-- the touched subcategories are recomputed rather than adjusted.
+CREATE INDEX IF NOT EXISTS product_subcategory_id_price_units_idx
+    ON public.product (subcategory_id, price, units);
+
+CREATE TABLE IF NOT EXISTS public.subcategory_stats (
+    subcategory_id integer PRIMARY KEY,
+    product_count bigint NOT NULL,
+    total_units bigint NOT NULL,
+    price_sum numeric NOT NULL,
+    min_price numeric NOT NULL,
+    max_price numeric NOT NULL,
+    stock_value numeric NOT NULL,
+    updated_at timestamp NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION public.refresh_subcategory_stats(subcategory_ids integer[]) RETURNS void
+    LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Writers touching the same subcategory take turns until commit, in id order to avoid deadlocks. Each statement
+    -- below runs after the lock is granted, so it sees the products committed by the previous holder.
+    PERFORM pg_advisory_xact_lock(80240001, subcategory_id)
+    FROM (SELECT DISTINCT subcategory_id FROM unnest(subcategory_ids) AS subcategory_id
+          WHERE subcategory_id IS NOT NULL ORDER BY subcategory_id) AS touched;
+
+    DELETE FROM public.subcategory_stats
+    WHERE subcategory_id = ANY(subcategory_ids)
+      AND NOT EXISTS (SELECT 1 FROM public.product WHERE product.subcategory_id = subcategory_stats.subcategory_id);
+
+    INSERT INTO public.subcategory_stats (subcategory_id, product_count, total_units, price_sum, min_price, max_price,
+                                          stock_value, updated_at)
+    SELECT subcategory_id, count(*), coalesce(sum(units), 0), sum(price), min(price), max(price),
+           coalesce(sum(price * units), 0), NOW()
+    FROM public.product
+    WHERE subcategory_id = ANY(subcategory_ids)
+    GROUP BY subcategory_id
+    ON CONFLICT (subcategory_id) DO UPDATE
+        SET product_count = EXCLUDED.product_count,
+            total_units = EXCLUDED.total_units,
+            price_sum = EXCLUDED.price_sum,
+            min_price = EXCLUDED.min_price,
+            max_price = EXCLUDED.max_price,
+            stock_value = EXCLUDED.stock_value,
+            updated_at = EXCLUDED.updated_at;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.product_stats_changed() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+DECLARE
+    touched integer[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT subcategory_id) INTO touched FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT subcategory_id) INTO touched FROM old_rows;
+    ELSE
+        -- Updates of the name, description or company do not change any figure.
+        SELECT array_agg(DISTINCT subcategory_id) INTO touched
+        FROM (SELECT old_rows.subcategory_id AS old_subcategory_id, new_rows.subcategory_id AS new_subcategory_id
+              FROM old_rows JOIN new_rows USING (product_id)
+              WHERE (old_rows.subcategory_id, old_rows.price, old_rows.units)
+                        IS DISTINCT FROM (new_rows.subcategory_id, new_rows.price, new_rows.units)) AS changed,
+             LATERAL (VALUES (changed.old_subcategory_id), (changed.new_subcategory_id)) AS ids (subcategory_id);
+    END IF;
+
+    IF touched IS NOT NULL THEN
+        PERFORM public.refresh_subcategory_stats(touched);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- TRUNCATE fires no row or transition table triggers, so it gets its own: no product is left in any subcategory.
+CREATE OR REPLACE FUNCTION public.product_stats_truncated() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+BEGIN
+    DELETE FROM public.subcategory_stats;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS product_stats_insert ON public.product;
+DROP TRIGGER IF EXISTS product_stats_update ON public.product;
+DROP TRIGGER IF EXISTS product_stats_delete ON public.product;
+DROP TRIGGER IF EXISTS product_stats_truncate ON public.product;
+CREATE TRIGGER product_stats_insert AFTER INSERT ON public.product
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION public.product_stats_changed();
+CREATE TRIGGER product_stats_update AFTER UPDATE ON public.product
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION public.product_stats_changed();
+CREATE TRIGGER product_stats_delete AFTER DELETE ON public.product
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION public.product_stats_changed();
+CREATE TRIGGER product_stats_truncate AFTER TRUNCATE ON public.product
+    FOR EACH STATEMENT EXECUTE FUNCTION public.product_stats_truncated();
+
+-- Backfill the products written before the triggers existed.
+SELECT public.refresh_subcategory_stats(array_agg(subcategory_id))
+FROM (SELECT DISTINCT subcategory_id FROM public.product) AS existing;
@@ -0,0 +1,22 @@
+-- Indexes backing GET /products/products/query/. Every index is paid for by each insert and by every update that is
+-- not HOT (updated_at changes on every write), including the CSV imports and the batch endpoints, so only the paths
+-- that would otherwise scan the whole table get one:
+-- * Unfiltered or loosely filtered pages (price range, in_stock) sorted by price or updated_at read them in order from
+--   (sort key, product_id) and stop after the page; (name, product_id) already exists (001).
+-- * company is an equality filter without any index yet: (company, name, product_id) finds its rows and serves the
+--   name sort directly; other sorts of a single company sort just those rows.
+-- * subcategory_id uses the index of 009, which starts with it, and the price sort comes from the same index. A
+--   category filter is subcategory_id IN (the category's subcategories): it reads each of them from that index and
+--   still sorts the rows of the category, which stays small next to the table.
+CREATE INDEX IF NOT EXISTS product_price_product_id_idx ON public.product (price, product_id);
+CREATE INDEX IF NOT EXISTS product_updated_at_product_id_idx ON public.product (updated_at, product_id);
+CREATE INDEX IF NOT EXISTS product_company_name_idx ON public.product (company, name, product_id);
+
+-- Created by an earlier version of this file; their write cost outweighed the sorts they saved.
+DROP INDEX IF EXISTS public.product_subcategory_id_name_idx;
+DROP INDEX IF EXISTS public.product_subcategory_id_updated_at_idx;
+DROP INDEX IF EXISTS public.product_company_price_idx;
+DROP INDEX IF EXISTS public.product_in_stock_name_idx;
+DROP INDEX IF EXISTS public.product_in_stock_price_idx;
+
+ANALYZE public.product;
@@ -0,0 +1,58 @@
+import os
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+CACHE_TTL = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "1024"))
+
+caches: List["TTLCache"] = []
+
+
+class TTLCache:
+    """In-process read-through cache with a time-to-live and a maximum number of entries (LRU eviction)."""
+
+    def __init__(self, name: str, ttl: float = CACHE_TTL, max_size: int = CACHE_MAX_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._generation = 0
+        caches.append(self)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for the key, calling the loader on a miss or an expired entry."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        generation = self._generation
+        value = await loader()
+        # Do not store a value loaded before an invalidation that happened while the loader was running.
+        if generation == self._generation:
+            self._entries[key] = (monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *keys: Hashable):
+        """Drop the given keys from the cache."""
+        self._generation += 1
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry from the cache."""
+        self._generation += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the size and the hit/miss counters of the cache."""
+        return {"name": self.name, "size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses}
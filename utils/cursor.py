@@ -0,0 +1,23 @@
+import base64
+import binascii
+import json
+
+
+def encode_cursor(order: str, key: list) -> str:
+    """Encode the sort order and the key of the last row of a page as an opaque cursor."""
+    payload = json.dumps({"order": order, "key": key}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, order: str) -> list:
+    """Decode a cursor produced by encode_cursor and return its key."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        key = payload["key"]
+        cursor_order = payload["order"]
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if cursor_order != order:
+        raise ValueError(f"Cursor was created for order '{cursor_order}', not '{order}'.")
+    return key
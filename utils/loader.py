@@ -0,0 +1,87 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+BatchLoadFunction = Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+
+request_loaders: ContextVar[Optional[Dict[str, "DataLoader"]]] = ContextVar("request_loaders", default=None)
+
+
+class DataLoader:
+    """Collect the keys requested during one event loop iteration and resolve them with a single batch call.
+
+    The batch function receives the list of keys and returns a dict of the values found; missing keys resolve to
+    None. Results are memoized for the lifetime of the loader.
+    """
+
+    def __init__(self, batch_load: BatchLoadFunction):
+        self.batch_load = batch_load
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Hashable] = []
+        # Strong references to the dispatches in flight; the event loop only keeps weak ones.
+        self._dispatches: Set[asyncio.Task] = set()
+
+    def load(self, key: Hashable) -> Awaitable[Any]:
+        """Return an awaitable resolving to the value of the key."""
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._queue.append(key)
+            if len(self._queue) == 1:
+                loop.call_soon(self._start_dispatch)
+        return future
+
+    def _start_dispatch(self):
+        task = asyncio.get_running_loop().create_task(self._dispatch())
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self):
+        keys, self._queue = self._queue, []
+        batch = [(key, self._futures[key]) for key in keys]
+        try:
+            values = await self.batch_load(keys)
+        except Exception as e:
+            for key, future in batch:
+                # Failures are not memoized, so a later load of the key tries again.
+                if self._futures.get(key) is future:
+                    del self._futures[key]
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch:
+            if not future.done():
+                future.set_result(values.get(key))
+
+
+def get_loader(name: str, batch_load: BatchLoadFunction) -> DataLoader:
+    """Return the loader with the given name for the current request, creating it on first use.
+
+    Outside a request there is nothing to share, so a new loader is returned every time.
+    """
+    loaders = request_loaders.get()
+    if loaders is None:
+        return DataLoader(batch_load)
+    loader = loaders.get(name)
+    if loader is None:
+        loader = loaders[name] = DataLoader(batch_load)
+    return loader
+
+
+class RequestLoadersMiddleware:
+    """ASGI middleware giving every HTTP request its own set of data loaders."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = request_loaders.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_loaders.reset(token)
@@ -0,0 +1,232 @@
+import hashlib
+import os
+import re
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+registry: List["Metric"] = []
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base class of the metrics exposed in the Prometheus text format."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type}\n"
+        return header + "".join(sample + "\n" for sample in self.samples())
+
+
+class Counter(Metric):
+    """A value that only goes up, one per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+                for labels, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """A value that is set to its current level, one per combination of label values."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+                for labels, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """Count observations in fixed buckets, one set of buckets per combination of label values."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label values: the (non-cumulative) count of every bucket plus +Inf, then the sum of the observations.
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """Return every registered metric in the Prometheus text exposition format."""
+    return "".join(metric.render() for metric in registry)
+
+
+pool_acquire_seconds = Histogram("db_pool_acquire_seconds", "Time spent waiting for a connection from the pool.")
+query_seconds = Histogram("db_query_duration_seconds", "Time spent executing a statement, including fetching its rows.",
+                          ["fingerprint"])
+query_rows = Histogram("db_query_rows", "Rows returned or affected by a statement.", ["fingerprint"], ROW_BUCKETS)
+query_errors = Counter("db_query_errors_total", "Statements that raised an error.", ["fingerprint"])
+statement_info = Gauge("db_statement_info", "Normalized SQL of every statement fingerprint.",
+                       ["fingerprint", "statement"])
+pool_connections = Gauge("db_pool_connections", "Connections of the pool by state.", ["state"])
+request_seconds = Histogram("http_request_duration_seconds",
+                            "Time spent handling a request, including streaming the body.",
+                            ["method", "route", "status"])
+request_db_seconds = Histogram("http_request_db_seconds",
+                               "Time a request spent waiting for connections and executing statements.",
+                               ["method", "route"])
+
+
+@dataclass
+class RequestTimings:
+    acquire: float = 0.0
+    execute: float = 0.0
+
+
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+LITERAL_PATTERNS = [
+    (re.compile(r"--[^\n]*"), " "),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%\(\w+\)s|%s|\$\d+"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(query: str) -> str:
+    """Return the statement with its literals and placeholders replaced by ? and its whitespace collapsed."""
+    for pattern, replacement in LITERAL_PATTERNS:
+        query = pattern.sub(replacement, query)
+    return query.strip()
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query: str) -> str:
+    """Return a short, stable identifier of the normalized statement, used as a metric label."""
+    normalized = normalize_sql(query)
+    value = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+    statement_info.set(1, value, normalized)
+    return value
+
+
+def observe_acquire(seconds: float):
+    """Record the time spent waiting for a pool connection."""
+    pool_acquire_seconds.observe(seconds)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.acquire += seconds
+
+
+def observe_query(query: str, seconds: float, rows: int, failed: bool = False):
+    """Record the execution of a statement."""
+    key = fingerprint(query)
+    query_seconds.observe(seconds, key)
+    if failed:
+        query_errors.inc(key)
+    elif rows >= 0:
+        query_rows.observe(rows, key)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.execute += seconds
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route template and status code."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def route_of(self, scope) -> str:
+        """Return the path template of the route that handled the request (its endpoint is set by the router)."""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            paths = {getattr(r, "endpoint", None): r.path for r in scope["app"].routes}
+            route = self._routes[endpoint] = paths.get(endpoint, "unmatched")
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - started
+            request_timings.reset(token)
+            route = self.route_of(scope)
+            request_seconds.observe(elapsed, scope["method"], route, str(status))
+            request_db_seconds.observe(timings.acquire + timings.execute, scope["method"], route)
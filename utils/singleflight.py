@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+groups: List["SingleFlight"] = []
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls: while a call with a given key is in flight, later callers await its
+    result instead of running it again."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        groups.append(self)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn for the key, or wait for the call already running for it, and return its result."""
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        # Shielded so that a cancelled caller does not cancel the call shared with the others.
+        return await asyncio.shield(task)
+
+    def forget(self):
+        """Stop sharing the calls in flight, so callers arriving after a write do not get results read before it.
+
+        Callers already waiting still receive their result.
+        """
+        self._in_flight.clear()
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller was cancelled.
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the call counters of the group."""
+        return {"name": self.name, "calls": self.calls, "executed": self.calls - self.coalesced,
+                "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+import re
+from collections import deque
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Set
+
+from utils.metrics import fingerprint, normalize_sql
+
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500")) / 1000
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() not in ("0", "false", "no")
+EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS", "60"))
+SLOW_QUERY_LOG_ENABLED = SLOW_QUERY_THRESHOLD > 0
+MAX_LOGGED_ITEMS = 10
+
+READ_ONLY_STATEMENT = re.compile(r"^\s*(SELECT|WITH)\b(?!.*\b(INSERT|UPDATE|DELETE|MERGE)\b)", re.I | re.S)
+EXPLAINABLE_STATEMENT = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b", re.I)
+
+ExplainFunction = Callable[[str, Any, bool], Awaitable[str]]
+
+logger = logging.getLogger(__name__)
+
+entries: Deque[Dict[str, Any]] = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+last_explained: Dict[str, float] = {}
+explain_tasks: Set[asyncio.Task] = set()
+
+
+def redact(value: Any) -> Any:
+    """Replace text parameters by their length and shorten long lists, keeping numbers, booleans and NULLs.
+
+    Parameters carry user data (names, descriptions, search terms) that should not end up in logs.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        items = [redact(item) for item in value[:MAX_LOGGED_ITEMS]]
+        if len(value) > MAX_LOGGED_ITEMS:
+            items.append(f"... {len(value) - MAX_LOGGED_ITEMS} more")
+        return items
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (str, bytes)):
+        return f"<redacted {len(value)} chars>"
+    return f"<redacted {type(value).__name__}>"
+
+
+def record(query: str, params: Any, seconds: float, explain: ExplainFunction):
+    """Log a statement that took longer than the threshold and capture its plan in the background.
+
+    EXPLAIN ANALYZE executes the statement again, so it is only used for read-only statements; writes get a plain
+    EXPLAIN. A statement is explained at most once per EXPLAIN_INTERVAL and one plan is captured at a time.
+    """
+    if query.lstrip()[:7].upper() == "EXPLAIN":
+        return
+    key = fingerprint(query)
+    entry = {
+        "logged_at": datetime.now(timezone.utc).isoformat(),
+        "duration_ms": round(seconds * 1000, 3),
+        "fingerprint": key,
+        "statement": normalize_sql(query),
+        "params": redact(params),
+        "plan": None,
+    }
+    entries.append(entry)
+    logger.warning("Slow query (%.0f ms) %s params=%s", entry["duration_ms"], entry["statement"], entry["params"])
+
+    now = monotonic()
+    if not SLOW_QUERY_EXPLAIN or explain_tasks or not EXPLAINABLE_STATEMENT.match(query) \
+            or now - last_explained.get(key, -EXPLAIN_INTERVAL) < EXPLAIN_INTERVAL:
+        return
+    last_explained[key] = now
+    task = asyncio.get_running_loop().create_task(capture_plan(entry, query, params, explain))
+    explain_tasks.add(task)
+    task.add_done_callback(explain_tasks.discard)
+
+
+async def capture_plan(entry: Dict[str, Any], query: str, params: Any, explain: ExplainFunction):
+    """Run EXPLAIN for a slow statement and attach the plan to its log entry."""
+    try:
+        entry["plan"] = await explain(query, params, bool(READ_ONLY_STATEMENT.match(query)))
+    except Exception as e:
+        entry["plan"] = f"EXPLAIN failed: {e}"
+    logger.info("Plan of slow query %s:\n%s", entry["fingerprint"], entry["plan"])
+
+
+def recent(limit: int) -> List[Dict[str, Any]]:
+    """Return the most recent slow queries, newest first."""
+    return list(entries)[::-1][:limit]
@@ -0,0 +1,20 @@
+from typing import AsyncIterator, List
+
+from pydantic import BaseModel
+
+
+async def iter_ndjson(batches: AsyncIterator[List[BaseModel]]) -> AsyncIterator[str]:
+    """Encode batches of models as newline-delimited JSON, one chunk per batch."""
+    async for batch in batches:
+        yield "".join(item.model_dump_json() + "\n" for item in batch)
+
+
+async def iter_json_array(batches: AsyncIterator[List[BaseModel]]) -> AsyncIterator[str]:
+    """Encode batches of models as a single JSON array, one chunk per batch."""
+    yield "["
+    separator = ""
+    async for batch in batches:
+        if batch:
+            yield separator + ",".join(item.model_dump_json() for item in batch)
+            separator = ","
+    yield "]"